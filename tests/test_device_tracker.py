@@ -0,0 +1,66 @@
+import socket
+import time
+
+import pytest
+
+from pin_checker import (SESSION_BACKENDS, AdbProtocolClient, DeviceTracker, EventLoopThread,
+                         NativeAdbSession, main)
+from pin_checker_sim import FakeAdbServer
+
+
+def test_tracker_forgets_devices_when_the_server_goes_away():
+    runner = EventLoopThread()
+    server = FakeAdbServer()
+    port = runner.call(server.start())
+    tracker = DeviceTracker(client=AdbProtocolClient(port=port), retry_delay=0.05)
+    try:
+        assert tracker.start()
+        assert tracker.snapshot() == {'emulator-5554': 'device'}
+        runner.call(server.stop())
+        assert tracker.wait_for(lambda devices: not devices, timeout=2)
+    finally:
+        tracker.stop()
+        runner.stop()
+
+
+@pytest.mark.parametrize('state', ['device', 'unauthorized'])
+def test_restart_adb_server_reports_the_new_servers_state(state, device):
+    checker = device.checker('session')
+    checker.tracker.retry_delay = 0.05
+    port = device.start_server()
+
+    def run_host(command, check=False):
+        if command[-1] == 'kill-server':
+            device.runner.call(device.server.stop())
+        elif command[-1] == 'start-server':
+            device.server = FakeAdbServer(device.run, {device.serial: state})
+            device.runner.call(device.server.start(port=port))
+
+    checker.run_host = run_host
+    assert checker.tracker.start()
+    assert checker.restart_adb_server(timeout=1) == (state == 'device')
+
+
+def unused_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_start_fails_without_a_server():
+    tracker = DeviceTracker(client=AdbProtocolClient(port=unused_port()), retry_delay=0.05)
+    try:
+        started = time.monotonic()
+        assert tracker.start(timeout=5) is False
+        assert time.monotonic() - started < 1  # the failed attempt ends the wait
+        assert not tracker.connected and tracker.connections == 0
+    finally:
+        tracker.stop()
+
+
+def test_devices_command_reports_an_unreachable_server(monkeypatch, capsys):
+    port = unused_port()
+    monkeypatch.setitem(SESSION_BACKENDS, 'native',
+                        lambda metrics: NativeAdbSession(port=port, metrics=metrics))
+    assert main(['devices', '--backend', 'native']) == 1
+    assert 'Could not reach the adb server' in capsys.readouterr().err
@@ -0,0 +1,55 @@
+from subprocess import CalledProcessError
+
+import pytest
+
+from pin_checker import InputSequence, Metrics
+
+
+@pytest.fixture
+def checker(device):
+    checker = device.checker('session', metrics=Metrics(enabled=True))
+    checker.time_scale = 0  # any delay left is one the device slept
+    return checker
+
+
+def test_script_chains_steps_and_ends_with_the_ack():
+    sequence = InputSequence().key(7, 8).delay(0.02).swipe(1, 2, 3, 4, 30).delay(0)
+    assert sequence.script() == (
+        "input keyevent 7 && input keyevent 8 && sleep 0.02 && "
+        f"input swipe 1 2 3 4 30 && echo {InputSequence.ACK}")
+    assert (len(sequence), sequence.events(), sequence.device_delay()) == (4, 3, 0.02)
+
+
+def test_delays_run_on_the_device(checker):
+    timing = checker.inject(InputSequence().key(7).delay(0.3).key(8))
+    assert timing.round_trips == 1 and timing.acknowledged
+    assert timing.device_delay == 0.3
+    assert timing.elapsed >= 0.3
+
+
+def test_missing_ack_raises(checker, monkeypatch):
+    monkeypatch.setattr(checker.session, 'execute', lambda command, timeout=None: (0, ''))
+    with pytest.raises(CalledProcessError):
+        checker.inject(InputSequence().key(7))
+
+
+def test_failed_step_stops_the_chain(checker, device):
+    sequence = InputSequence().key(8)
+    sequence.steps.append(['input', 'frobnicate'])
+    sequence.key(9)
+    with pytest.raises(CalledProcessError) as error:
+        checker.inject(sequence)
+    assert error.value.returncode == 1
+    with open(f'{device.root}/buffer') as handle:
+        assert handle.read() == '1'  # the key after the failure never ran
+
+
+def test_enter_pin_is_one_round_trip(checker, device):
+    checker.shell('true')  # connect the session first
+    before = checker.metrics.snapshot()['counters']['device_commands']
+    assert checker.enter_pin('1234')
+    counters = checker.metrics.snapshot()['counters']
+    assert counters['device_commands'] - before == 1
+    assert counters['input_round_trips'] == 1
+    assert counters['input_events'] == 5
+    assert not device.is_locked()
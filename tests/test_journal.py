@@ -0,0 +1,140 @@
+import os
+import zlib
+
+import pytest
+
+from pin_checker import (ATTEMPT_FAILED, ATTEMPT_UNLOCKED, AttemptJournal, JournalError, Metrics,
+                         NumericCandidates)
+
+SPACE = NumericCandidates(4).space
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'run.jnl')
+
+
+def recorded(path, indices, unlocked=None, space=SPACE):
+    journal = AttemptJournal.open(path, space)
+    for index in indices:
+        journal.record(index, ATTEMPT_UNLOCKED if index == unlocked else ATTEMPT_FAILED)
+    return journal
+
+
+def test_round_trip(path):
+    recorded(path, [0, 3, 9, 1234], unlocked=1234).close()
+    journal = AttemptJournal.open(path, SPACE)
+    assert [index for index in range(2000) if journal.is_done(index)] == [0, 3, 9, 1234]
+    assert journal.completed() == 4
+    assert journal.unlocked == 1234
+    journal.close()
+
+
+def test_records_survive_without_close(path):
+    journal = recorded(path, range(5))
+    journal.sync()  # what a crash after the group commit leaves behind
+    assert AttemptJournal.open(path, SPACE).completed() == 5
+
+
+def test_torn_tail_is_dropped(path):
+    journal = recorded(path, [1, 2])
+    journal.sync()
+    with open(path, 'ab') as handle:
+        handle.write(AttemptJournal.RECORD.pack(7, ATTEMPT_FAILED, 0)[:5])
+    reopened = AttemptJournal.open(path, SPACE)
+    assert reopened.completed() == 2 and not reopened.is_done(7)
+
+
+def test_bad_crc_ends_the_replay(path):
+    journal = recorded(path, [1])
+    journal.sync()
+    with open(path, 'ab') as handle:
+        handle.write(AttemptJournal.RECORD.pack(7, ATTEMPT_FAILED, 12345))
+    assert not AttemptJournal.open(path, SPACE).is_done(7)
+
+
+def test_wrong_space_is_refused(path):
+    recorded(path, [1]).close()
+    with pytest.raises(JournalError, match='different search'):
+        AttemptJournal.open(path, NumericCandidates(6).space)
+
+
+def test_empty_log_after_a_crash_keeps_the_snapshot(path):
+    recorded(path, [4, 5]).close()
+    AttemptJournal.open(path, SPACE).close()  # opening folds the log into the snapshot
+    open(path, 'wb').close()
+    assert AttemptJournal.open(path, SPACE).completed() == 2
+
+
+def test_damaged_header_is_a_journal_error(path):
+    recorded(path, [4]).close()
+    with open(path, 'r+b') as handle:
+        handle.truncate(len(AttemptJournal.MAGIC) + 1)
+    with pytest.raises(JournalError, match='damaged header'):
+        AttemptJournal.open(path, SPACE)
+
+
+def test_import_is_kept_after_compact(tmp_path, path):
+    other = str(tmp_path / 'other.jnl')
+    recorded(other, [10, 11]).close()
+    journal = AttemptJournal.open(path, SPACE)
+    journal.import_from(other)
+    journal.compact()
+    journal.close()
+    os.remove(other)
+    os.remove(f"{other}.snapshot")
+    assert AttemptJournal.open(path, SPACE).completed() == 2
+
+
+@pytest.mark.parametrize('device', [{'pin': '0007'}], indirect=True)
+def test_check_all_pins_resumes_where_it_stopped(path, device):
+    recorded(path, range(5)).close()
+    checker = device.checker('session', headless=True, status_interval=3600)
+    checker.time_scale = 0
+    checker.journal = AttemptJournal.open(path, SPACE)
+    assert checker.check_all_pins(NumericCandidates(4, 0, 10)) == '0007'
+    assert checker.attempts == 3
+    checker.journal.close()
+    assert AttemptJournal.open(path, SPACE).unlocked == 7
+
+
+def test_large_indices_stay_sparse(path):
+    space = NumericCandidates(10).space
+    recorded(path, [9_999_999_990], space=space).close()
+    assert os.path.getsize(f"{path}.snapshot") < 1024
+    journal = AttemptJournal.open(path, space)
+    assert journal.is_done(9_999_999_990) and not journal.is_done(9_999_999_991)
+    assert journal.completed() == 1 and len(journal.pages) == 1
+    journal.close()
+
+
+def test_dense_snapshot_is_still_read(path):
+    journal = AttemptJournal(path, SPACE)
+    bitmap = bytes([0b1001, 0, 0b10])  # indices 0, 3 and 17
+    with open(journal.snapshot_path, 'wb') as handle:
+        handle.write(journal._header(AttemptJournal.DENSE_SNAPSHOT_MAGIC, unlocked=17,
+                                     crc=zlib.crc32(bitmap)))
+        handle.write(bitmap)
+    journal = AttemptJournal.open(path, SPACE)
+    assert [index for index in range(20) if journal.is_done(index)] == [0, 3, 17]
+    assert journal.unlocked == 17
+    journal.close()
+
+
+def test_missing_import_is_an_error(tmp_path, path):
+    journal = AttemptJournal.open(path, SPACE)
+    with pytest.raises(JournalError, match='no such journal'):
+        journal.import_from(str(tmp_path / 'typo.jnl'))
+    with pytest.raises(JournalError, match='no such journal'):
+        journal.import_from(str(tmp_path / 'typo.jnl.snapshot'))
+    journal.close()
+
+
+def test_found_pin_is_reported_without_touching_the_device(path, device):
+    recorded(path, [3, 42], unlocked=42).close()
+    checker = device.checker('session', metrics=Metrics(enabled=True))
+    checker.journal = AttemptJournal.open(path, SPACE)
+    assert checker.check_all_pins(NumericCandidates(4)) == '0042'
+    assert checker.outcome == 'found'
+    assert 'device_commands' not in checker.metrics.snapshot()['counters']
+    checker.journal.close()
@@ -0,0 +1,80 @@
+import pytest
+
+from pin_checker import GrepLockProbe, LockProbeBackend, LockStateProbe
+
+
+class ScriptedProbe(LockProbeBackend):
+    """Answers from a list, repeating the last answer; counts its reads"""
+
+    def __init__(self, name, cost, answers, size=10):
+        self.name = name
+        self.cost = cost
+        self.answers = list(answers)
+        self.size = size
+        self.reads = 0
+
+    def read(self, checker):
+        self.reads += 1
+        answer = self.answers.pop(0) if len(self.answers) > 1 else self.answers[0]
+        return answer, self.size
+
+
+def reads(*backends):
+    return [backend.reads for backend in backends]
+
+
+def test_selects_the_cheapest_backend_that_finds_the_flag():
+    cheap = ScriptedProbe('cheap', 1, [None])
+    middle = ScriptedProbe('middle', 2, [False], size=100)
+    dear = ScriptedProbe('dear', 3, [False], size=1000)
+    probe = LockStateProbe([dear, middle, cheap])
+    assert probe.probe(None).unlocked is False
+    assert probe.probe(None).backend == 'middle'
+    assert reads(cheap, middle, dear) == [1, 2, 0]
+    assert probe.stats['middle']['probes'] == 2
+    assert probe.stats['middle']['bytes'] == 200
+    assert probe.stats['dear'] == {'probes': 0, 'bytes': 0, 'seconds': 0.0}
+
+
+def test_a_backend_that_stops_answering_is_not_read_twice():
+    cheap = ScriptedProbe('cheap', 1, [False, None])
+    dear = ScriptedProbe('dear', 2, [True])
+    probe = LockStateProbe([cheap, dear])
+    probe.probe(None)
+    result = probe.probe(None)
+    assert (result.unlocked, result.backend) == (True, 'dear')
+    assert reads(cheap, dear) == [2, 1]
+    assert probe.selected is dear
+
+
+def test_no_backend_finding_the_flag_costs_one_read_per_probe():
+    backends = [ScriptedProbe(name, cost, [None]) for cost, name in enumerate('abc')]
+    probe = LockStateProbe(backends)
+    assert probe.probe(None).unlocked is None
+    assert reads(*backends) == [1, 1, 1]
+    for _ in range(3):
+        assert probe.probe(None).backend == 'a'  # the cheapest is kept
+    assert reads(*backends) == [4, 1, 1]
+    probe.reset()
+    probe.probe(None)
+    assert reads(*backends) == [5, 2, 2]
+
+
+def test_losing_the_flag_keeps_the_cheapest_backend():
+    cheap = ScriptedProbe('cheap', 1, [None])
+    dear = ScriptedProbe('dear', 2, [False, None])
+    probe = LockStateProbe([cheap, dear])
+    probe.probe(None)
+    assert probe.probe(None).unlocked is None
+    assert probe.selected is cheap and probe.unsupported
+
+
+@pytest.mark.parametrize('device', [{'dumpsys_size': 64 * 1024}], indirect=True)
+@pytest.mark.parametrize('locked', [True, False])
+def test_fake_device_is_probed_with_grep(locked, device):
+    checker = device.checker('session')
+    if not locked:
+        checker.enter_pin(device.pin)
+    assert checker.check_if_unlocked() is not locked
+    assert checker.lock_probe.selected.name == GrepLockProbe.name
+    assert 0 < checker.lock_probe.last.bytes_read < 64
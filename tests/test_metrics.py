@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from pin_checker import LatencyHistogram, Metrics
+
+
+def test_percentiles_stay_within_bucket_precision():
+    histogram = LatencyHistogram()
+    for millis in range(1, 1001):
+        histogram.record(millis / 1000)
+    assert histogram.count == 1000
+    for percent, expected in ((50, 0.5), (95, 0.95), (99, 0.99), (100, 1.0)):
+        assert histogram.percentile(percent) == pytest.approx(expected, rel=0.01)
+    assert (histogram.min, histogram.max) == (0.001, 1.0)
+
+
+def test_empty_histogram_summary():
+    summary = LatencyHistogram().summary()
+    assert summary['count'] == 0
+    assert summary['p99'] == summary['mean'] == 0.0
+
+
+def test_json_and_prometheus_export(tmp_path):
+    json_path, prom_path = tmp_path / 'metrics.json', tmp_path / 'metrics.prom'
+    metrics = Metrics(enabled=True, json_path=str(json_path), prometheus_path=str(prom_path))
+    for seconds in (0.01, 0.02, 0.03):
+        metrics.observe('enter_pin', seconds)
+    metrics.increment('device_commands', 3)
+    metrics.export()
+
+    snapshot = json.loads(json_path.read_text())
+    assert snapshot['operations']['enter_pin']['count'] == 3
+    assert snapshot['operations']['enter_pin']['sum'] == pytest.approx(0.06)
+    assert snapshot['counters'] == {'device_commands': 3}
+
+    lines = prom_path.read_text().splitlines()
+    assert 'pin_checker_operation_seconds_count{operation="enter_pin"} 3' in lines
+    assert 'pin_checker_operation_seconds_sum{operation="enter_pin"} 0.060000' in lines
+    assert any(line.startswith('pin_checker_operation_seconds{operation="enter_pin",'
+                               'quantile="0.99"}') for line in lines)
+    assert 'pin_checker_device_commands_total 3' in lines
+
+
+def test_disabled_metrics_record_nothing(tmp_path):
+    metrics = Metrics(json_path=str(tmp_path / 'metrics.json'))
+    with metrics.timer('enter_pin'):
+        pass
+    metrics.increment('device_commands')
+    metrics.export()
+    assert metrics.snapshot()['operations'] == {}
+    assert not (tmp_path / 'metrics.json').exists()
+
+
+@pytest.mark.parametrize('backend', ['session', 'subprocess', 'native'])
+def test_bytes_read_counts_encoded_output(backend, device):
+    checker = device.checker(backend, metrics=Metrics(enabled=True))
+    checker.shell_script("printf '\\303\\251t\\303\\251'")  # "été": 3 characters, 5 bytes
+    assert checker.metrics.snapshot()['counters']['bytes_read'] == 5
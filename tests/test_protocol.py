@@ -0,0 +1,78 @@
+import pytest
+
+from pin_checker import (AdbProtocolClient, AdbProtocolError, EventLoopThread,
+                         NativeAdbSession)
+from pin_checker_sim import FakeAdbServer
+
+
+def handler(command):
+    """`exit N` fails with N; anything else is echoed back"""
+    words = command.split()
+    if words[:1] == ['exit']:
+        return int(words[1]), b''
+    return 0, command.encode() + b'\n'
+
+
+@pytest.fixture
+def server():
+    runner = EventLoopThread()
+    server = FakeAdbServer(handler, {'emulator-5554': 'device', 'emulator-5556': 'offline'})
+    runner.call(server.start())
+    server.runner = runner
+    yield server
+    runner.call(server.stop())
+    runner.stop()
+
+
+@pytest.fixture
+def client(server):
+    return AdbProtocolClient(port=server.port)
+
+
+def test_devices(server, client):
+    assert server.runner.call(client.devices(), 5) == [
+        ('emulator-5554', 'device'), ('emulator-5556', 'offline')]
+
+
+def test_track_devices_reports_changes(server, client):
+    async def first_two():
+        stream = client.track_devices()
+        initial = await stream.__anext__()
+        server.set_state('emulator-5556', 'device')
+        changed = await stream.__anext__()
+        await stream.aclose()
+        return initial, changed
+
+    initial, changed = server.runner.call(first_two(), 5)
+    assert ('emulator-5556', 'offline') in initial
+    assert ('emulator-5556', 'device') in changed
+
+
+@pytest.mark.parametrize('v2', [True, False])
+def test_shell_output_and_exit_code(server, client, v2):
+    server.shell_v2 = v2
+    assert server.runner.call(client.shell('echo hello'), 5) == (0, b'echo hello\n', b'')
+    assert server.runner.call(client.shell('exit 3'), 5)[0] == 3
+    assert client.shell_v2 is v2
+
+
+def test_v1_output_larger_than_marker_holdback(server, client):
+    server.shell_v2 = False
+    server.shell_handler = lambda command: (7, b'x' * 1000)
+    returncode, stdout, _ = server.runner.call(client.shell('big'), 5)
+    assert (returncode, stdout) == (7, b'x' * 1000)
+
+
+def test_transport_to_unready_device_fails(server):
+    client = AdbProtocolClient(port=server.port, serial='emulator-5556')
+    with pytest.raises(AdbProtocolError, match='device not found'):
+        server.runner.call(client.shell('true'), 5)
+
+
+def test_native_session_execute(server):
+    session = NativeAdbSession(port=server.port, serial='emulator-5554')
+    try:
+        assert session.execute('exit 2') == (2, '')
+        assert session.execute('echo hi') == (0, 'echo hi\n')
+    finally:
+        session.close()
@@ -0,0 +1,112 @@
+import pytest
+
+from pin_checker import BatchResult, SessionWrapper, SettingsBatch, ShellSessionError
+
+
+@pytest.fixture
+def shell(device):
+    session = device.session('session')
+    yield lambda batch: batch.parse(session.execute(batch.script())[1])
+    session.close()
+
+
+def developer_batch():
+    batch = SettingsBatch()
+    batch.put_setting('global', 'development_settings_enabled', 1)
+    batch.set_prop('persist.sys.usb.config', 'mtp,adb', restart=True, disconnects=True)
+    return batch
+
+
+def test_first_run_writes_and_second_run_skips(shell):
+    batch = developer_batch()
+    assert list(shell(batch).values()) == [BatchResult(0, True), BatchResult(0, True)]
+    assert list(shell(batch).values()) == [BatchResult(0, False), BatchResult(0, False)]
+
+
+def test_needs_restart_only_when_flagged_write_changed(shell):
+    batch = developer_batch()
+    assert batch.needs_restart(shell(batch))
+    assert not batch.needs_restart(shell(batch))
+
+
+def test_later_write_to_same_key_replaces_earlier(shell, device):
+    batch = SettingsBatch()
+    batch.put_setting('global', 'stay_on_while_plugged_in', 0)
+    batch.set_prop('debug.example', 'x')
+    batch.put_setting('global', 'stay_on_while_plugged_in', 7)
+    assert list(batch.ops) == ['prop/debug.example', 'global/stay_on_while_plugged_in']
+    shell(batch)
+    with open(f'{device.root}/settings/global.stay_on_while_plugged_in') as handle:
+        assert handle.read().strip() == '7'
+
+
+def test_failed_command_reports_its_exit_code(shell):
+    batch = SettingsBatch()
+    batch.command('bad', ['settings', 'frobnicate'])
+    batch.command('good', ['true'])
+    results = shell(batch)
+    assert results['bad'].returncode == 1
+    assert results['good'] == BatchResult(0, True)
+
+
+def test_parse_marks_missing_keys_as_not_run():
+    batch = developer_batch()
+    output = 'noise\n%s 0 0 1\n' % SettingsBatch.MARKER
+    results = batch.parse(output)
+    assert results['global/development_settings_enabled'] == BatchResult(0, True)
+    assert results['prop/persist.sys.usb.config'] == BatchResult(None, False)
+
+
+def test_writes_that_may_disconnect_come_last():
+    batch = developer_batch()
+    batch.put_setting('global', 'stay_on_while_plugged_in', 7, restart=True)
+    lines = batch.script().splitlines()
+    assert 'setprop' in lines[-1]
+    assert 'setprop' not in batch.script(disconnects=False)
+    assert batch.script(disconnects=True) == lines[-1]
+
+
+class FailingSession(SessionWrapper):
+    """Fails every command containing `trigger`, optionally dropping the shell"""
+
+    def __init__(self, inner, trigger, message):
+        super().__init__(inner)
+        self.trigger = trigger
+        self.message = message
+
+    def execute(self, command, timeout=None):
+        if self.trigger in command:
+            self.inner.close()
+            raise ShellSessionError(self.message, sent=True)
+        return self.inner.execute(command, timeout)
+
+
+@pytest.fixture
+def checker(device):
+    checker = device.checker('session')
+    checker.restarts = []
+    checker.restart_adb_server = lambda: checker.restarts.append(True) or True
+    return checker
+
+
+def test_usb_function_switch_dropping_the_shell_still_succeeds(checker, device):
+    checker.session = FailingSession(checker.session, 'setFunction',
+                                     "shell session closed unexpectedly")
+    assert checker.handle_usb_data_access() is True
+    assert checker.restarts == [True]
+    with open(f'{device.root}/settings/global.usb_mass_storage_enabled') as handle:
+        assert handle.read().strip() == '1'
+
+
+def test_failed_settings_writes_are_not_taken_as_applied(checker):
+    checker.session = FailingSession(checker.session, 'adb_authorized',
+                                     "error: device unauthorized")
+    batch = SettingsBatch()
+    batch.put_setting('secure', 'adb_authorized', 1, restart=True)
+    assert checker.apply_settings(batch) is None
+    assert checker.restarts == []
+
+
+def test_failed_restart_fails_the_batch(checker):
+    checker.restart_adb_server = lambda: False
+    assert checker.handle_usb_data_access() is False
@@ -0,0 +1,51 @@
+import pytest
+
+from pin_checker import AdbShellSession, Metrics, ShellSessionError
+
+
+@pytest.fixture
+def session():
+    session = AdbShellSession(['sh'], timeout=5, metrics=Metrics(enabled=True))
+    session.start()
+    yield session
+    session.close()
+
+
+def spawns(session):
+    return session.metrics.snapshot()['counters']['subprocess_spawns']
+
+
+@pytest.mark.parametrize('command, output', [
+    ('printf abc', 'abc'),
+    ('echo abc', 'abc\n'),
+    ('printf "a\\n\\nb\\n\\n"', 'a\n\nb\n\n'),
+    ('true', ''),
+])
+def test_output_framing(session, command, output):
+    assert session.execute(command) == (0, output)
+
+
+def test_exit_codes(session):
+    assert session.execute('false')[0] == 1
+    assert session.execute('echo oops >&2; exit 3') == (3, 'oops\n')
+    assert session.execute('true')[0] == 0  # the shell survives a command's exit
+
+
+def test_restarts_a_shell_that_died_before_the_command(session):
+    session.process.kill()
+    session.process.wait()
+    assert session.execute('echo hi') == (0, 'hi\n')
+    assert spawns(session) == 2
+
+
+def test_timed_out_command_is_not_sent_again(session, tmp_path):
+    ran = tmp_path / 'ran'
+    with pytest.raises(ShellSessionError) as error:
+        session.execute(f'echo x >> {ran}; sleep 5', timeout=0.3)
+    assert error.value.sent
+    assert not session.is_alive()
+    assert ran.read_text() == 'x\n'
+    # The next command gets a fresh shell; the timed-out one is not replayed
+    assert session.execute('echo next') == (0, 'next\n')
+    assert ran.read_text() == 'x\n'
+    assert spawns(session) == 2
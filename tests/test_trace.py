@@ -0,0 +1,117 @@
+import gzip
+import json
+import time
+from subprocess import CompletedProcess
+
+import pytest
+
+from pin_checker import NumericCandidates, SessionWrapper, StreamingLockProbe, main
+from pin_checker_sim import FakeAdbServer
+
+
+def record_run(path, make_device):
+    """Record a search that finds 0002 on its third attempt; returns the PIN found"""
+    device = make_device(pin='0002')
+    checker = device.checker('session', headless=True, status_interval=3600)
+    checker.time_scale = 0
+    checker.record_to(path, {'candidates': {'length': 4, 'end': 5}})
+    found = checker.check_all_pins(NumericCandidates(4, 0, 5))
+    checker.recorder.close()
+    return found
+
+
+def test_replay_prints_only_the_json_report(tmp_path, make_device, capsys):
+    path = str(tmp_path / 'run.trace')
+    assert record_run(path, make_device) == '0002'
+    capsys.readouterr()
+    assert main(['replay', path, '--speed', '0']) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report['found'] == '0002'
+    assert report['attempts'] == 3
+    assert report['commands_missing'] == 0
+
+
+def test_recording_keeps_the_native_stream_probe_available(tmp_path, device):
+    checker = device.checker('native')
+    checker.record_to(str(tmp_path / 'run.trace'))
+    assert StreamingLockProbe().available(checker)
+    unlocked, bytes_read = StreamingLockProbe().read(checker)
+    assert unlocked is False and bytes_read > 0
+    checker.recorder.close()
+
+
+class AuthorizesOnRequest(SessionWrapper):
+    """Flips the device to authorized once the setup writes adb_authorized"""
+
+    def __init__(self, inner, device):
+        super().__init__(inner)
+        self.device = device
+
+    def execute(self, command, timeout=None):
+        if 'adb_authorized' in command:
+            self.device.runner.loop.call_soon_threadsafe(
+                self.device.server.set_state, self.device.serial, 'device')
+        return self.inner.execute(command, timeout)
+
+
+def record_setup(path, device, monkeypatch):
+    """Record setup_checks through an authorization and two adb restarts"""
+    port = device.start_server()
+    device.server.devices[device.serial] = 'unauthorized'
+
+    def adb(command, **kwargs):
+        if command[-1] == 'kill-server':
+            device.runner.call(device.server.stop())
+        elif command[-1] == 'start-server':
+            device.server = FakeAdbServer(device.run, {device.serial: 'device'})
+            device.runner.call(device.server.start(port=port))
+        return CompletedProcess(command, 0, stdout='')
+
+    monkeypatch.setattr('pin_checker.run', adb)
+    checker = device.checker('session', headless=True, status_interval=3600)
+    checker.tracker.retry_delay = 0.05
+    checker.session = AuthorizesOnRequest(checker.session, device)
+    checker.record_to(path, {'candidates': {'length': 4, 'end': 2}})
+    assert checker.setup_checks(allow_root=True, interactive=False)
+    checker.recorder.close()
+    monkeypatch.undo()
+
+
+def test_replayed_setup_follows_the_recorded_device_lists(tmp_path, device, monkeypatch,
+                                                          capsys):
+    path = str(tmp_path / 'setup.trace')
+    record_setup(path, device, monkeypatch)
+    capsys.readouterr()
+    started = time.perf_counter()
+    assert main(['replay', path, '--setup', '--speed', '0']) == 0
+    elapsed = time.perf_counter() - started
+    report = json.loads(capsys.readouterr().out)
+    assert report['setup'] is True
+    assert report['operations']['adb_restart']['count'] == 2
+    assert elapsed < 2  # no restart or authorization wait sat out its timeout
+
+
+def unclosed_trace(path, make_device):
+    record_run(path, make_device)
+    with open(path, 'rb') as handle:
+        data = handle.read()
+    with open(path, 'wb') as handle:
+        handle.write(data[:len(data) // 2])  # what a killed recording leaves
+
+
+@pytest.mark.parametrize('make, message', [
+    (lambda path, make_device: None, 'No such file'),
+    (lambda path, make_device: open(path, 'w').write('not a trace'), 'Not a gzipped file'),
+    (lambda path, make_device: gzip.open(path, 'wb').write(b'PCJRNL1\n'),
+     'is not a PIN checker trace'),
+    (unclosed_trace, 'end-of-stream marker'),
+])
+def test_unreadable_trace_is_a_one_line_error(make, message, tmp_path, make_device, capsys):
+    path = str(tmp_path / 'run.trace')
+    make(path, make_device)
+    capsys.readouterr()
+    assert main(['replay', path, '--speed', '0']) == 1
+    captured = capsys.readouterr()
+    assert captured.out == ''
+    assert captured.err.startswith(f'Cannot replay {path}: ')
+    assert message in captured.err